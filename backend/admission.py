@@ -0,0 +1,175 @@
+"""Admission control for expensive endpoints.
+
+Each key (a workshop id) gets a token bucket that refills at ``rate`` requests
+per second up to ``burst`` tokens, plus a cap of ``max_concurrent`` requests in
+flight. A rejected request gets the number of seconds to wait before retrying.
+
+``InMemoryAdmissionBackend`` is enough for a single worker process.
+``MongoAdmissionBackend`` keeps the state in a shared collection so several
+workers enforce one limit together.
+"""
+import math
+import time
+import uuid
+from collections import Counter
+from typing import Optional
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+
+class AdmissionPolicy:
+    def __init__(self, rate: float, burst: int, max_concurrent: int):
+        self.rate = rate
+        self.burst = burst
+        self.max_concurrent = max_concurrent
+
+
+class Rejected(Exception):
+    def __init__(self, retry_after: float, reason: str):
+        super().__init__(reason)
+        self.retry_after = retry_after
+        self.reason = reason
+
+    @property
+    def retry_after_header(self) -> str:
+        return str(max(1, math.ceil(self.retry_after)))
+
+
+class AdmissionBackend:
+    """Storage for token buckets and in-flight counts.
+
+    ``acquire`` returns an opaque ticket when the request is admitted and
+    raises ``Rejected`` otherwise. Every ticket must be passed to ``release``.
+    """
+
+    async def acquire(self, key: str, policy: AdmissionPolicy):
+        raise NotImplementedError
+
+    async def release(self, key: str, ticket) -> None:
+        raise NotImplementedError
+
+
+class InMemoryAdmissionBackend(AdmissionBackend):
+    def __init__(self, clock=time.monotonic):
+        self._clock = clock
+        self._buckets = {}
+        self._in_flight = Counter()
+
+    # Neither method awaits, so each runs atomically on the event loop
+    async def acquire(self, key: str, policy: AdmissionPolicy):
+        if self._in_flight[key] >= policy.max_concurrent:
+            raise Rejected(1, "Too many concurrent requests")
+
+        now = self._clock()
+        tokens, updated = self._buckets.get(key, (policy.burst, now))
+        tokens = min(policy.burst, tokens + (now - updated) * policy.rate)
+        if tokens < 1:
+            self._buckets[key] = (tokens, now)
+            raise Rejected((1 - tokens) / policy.rate, "Rate limit exceeded")
+
+        self._buckets[key] = (tokens - 1, now)
+        self._in_flight[key] += 1
+        return key
+
+    async def release(self, key: str, ticket) -> None:
+        self._in_flight[key] -= 1
+        if self._in_flight[key] <= 0:
+            del self._in_flight[key]
+
+
+class MongoAdmissionBackend(AdmissionBackend):
+    """Shared admission state stored in one document per key.
+
+    Both the bucket refill and the in-flight check are single atomic
+    pipeline updates. In-flight requests are recorded as leases with an
+    expiry, so a worker that dies mid-request cannot leak capacity for longer
+    than ``lease_seconds``.
+    """
+
+    def __init__(self, collection, lease_seconds: float = 120, clock=time.time):
+        self.collection = collection
+        self.lease_seconds = lease_seconds
+        self._clock = clock
+
+    async def acquire(self, key: str, policy: AdmissionPolicy):
+        now = self._clock()
+        bucket = await self._take_token(key, policy, now)
+        if not bucket["admitted"]:
+            raise Rejected((1 - bucket["tokens"]) / policy.rate, "Rate limit exceeded")
+
+        lease = {"id": str(uuid.uuid4()), "expires": now + self.lease_seconds}
+        if not await self._add_lease(key, policy, lease, now):
+            # Like the in-memory backend, a request rejected for concurrency keeps its token
+            await self.collection.update_one(
+                {"_id": f"bucket:{key}"},
+                [{"$set": {"tokens": {"$min": [policy.burst, {"$add": ["$tokens", 1]}]}}}],
+            )
+            raise Rejected(1, "Too many concurrent requests")
+        return lease["id"]
+
+    async def _take_token(self, key: str, policy: AdmissionPolicy, now: float) -> dict:
+        refilled = {"$min": [
+            policy.burst,
+            {"$add": [
+                {"$ifNull": ["$tokens", policy.burst]},
+                {"$multiply": [{"$subtract": [now, {"$ifNull": ["$updated", now]}]}, policy.rate]},
+            ]},
+        ]}
+        update = [
+            {"$set": {"tokens": refilled, "updated": now}},
+            {"$set": {"admitted": {"$gte": ["$tokens", 1]}}},
+            {"$set": {"tokens": {"$cond": ["$admitted", {"$subtract": ["$tokens", 1]}, "$tokens"]}}},
+        ]
+        try:
+            return await self.collection.find_one_and_update(
+                {"_id": f"bucket:{key}"}, update, upsert=True, return_document=ReturnDocument.AFTER
+            )
+        except DuplicateKeyError:
+            # Another request created the bucket first; it exists now, so this matches it
+            return await self.collection.find_one_and_update(
+                {"_id": f"bucket:{key}"}, update, upsert=True, return_document=ReturnDocument.AFTER
+            )
+
+    async def _add_lease(self, key: str, policy: AdmissionPolicy, lease: dict, now: float) -> bool:
+        live_leases = {"$filter": {
+            "input": {"$ifNull": ["$leases", []]},
+            "cond": {"$gt": ["$$this.expires", now]},
+        }}
+        # The filter only matches while capacity is left; when the document
+        # exists but is full the upsert collides on _id instead. A collision
+        # can also mean a concurrent request created the document first, so
+        # only a second collision means the cap is reached.
+        for _ in range(2):
+            try:
+                await self.collection.update_one(
+                    {"_id": f"inflight:{key}", "$expr": {"$lt": [{"$size": live_leases}, policy.max_concurrent]}},
+                    [{"$set": {"leases": {"$concatArrays": [live_leases, [{"$literal": lease}]]}}}],
+                    upsert=True,
+                )
+                return True
+            except DuplicateKeyError:
+                pass
+        return False
+
+    async def release(self, key: str, ticket: str) -> None:
+        await self.collection.update_one({"_id": f"inflight:{key}"}, {"$pull": {"leases": {"id": ticket}}})
+
+
+class AdmissionController:
+    def __init__(self, backend: AdmissionBackend, policy: AdmissionPolicy):
+        self.backend = backend
+        self.policy = policy
+        self.stats = Counter()
+
+    async def acquire(self, key: str):
+        try:
+            ticket = await self.backend.acquire(key, self.policy)
+        except Rejected:
+            self.stats["rejected"] += 1
+            raise
+        self.stats["admitted"] += 1
+        return ticket
+
+    async def release(self, key: str, ticket: Optional[object]) -> None:
+        await self.backend.release(key, ticket)
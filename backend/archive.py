@@ -0,0 +1,196 @@
+"""Archive tier for settled service history.
+
+Sessions older than a cutoff whose payments cover their services are moved,
+together with their services and payments, from the hot collections into
+``archived_*`` collections. A compact per-customer rollup keeps the archived
+totals, so summaries and the dashboard stay correct while only reading the
+hot tier.
+
+Each batch is copied first, then deleted from the hot tier, then the affected
+rollups are recomputed from the archive. Rollups are flagged ``stale`` before
+the delete, and stale rollups are recomputed at the start of every run, so an
+interrupted run is repaired by the next one.
+
+Only the copied version of each service and payment is deleted. A session
+that gained or changed a service or payment while it was being archived is
+moved back to the hot tier instead, so concurrent writes are never lost.
+"""
+import logging
+from datetime import datetime, timedelta
+from typing import Optional
+
+from pymongo import DeleteOne, UpdateOne
+from pymongo.errors import BulkWriteError
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_COLLECTIONS = {
+    "service_sessions": "archived_service_sessions",
+    "services": "archived_services",
+    "payments": "archived_payments",
+}
+ROLLUP_COLLECTION = "customer_archive_rollups"
+
+DUPLICATE_KEY_ERROR = 11000
+# Remaining debt at or below this is treated as fully paid
+SETTLED_TOLERANCE = 0.005
+
+
+async def ensure_archive_indexes(db):
+    for archive in ARCHIVE_COLLECTIONS.values():
+        await db[archive].create_index("id", unique=True)
+        await db[archive].create_index([("workshop_id", 1), ("customer_id", 1)])
+    await db.archived_services.create_index("service_session_id")
+    await db.archived_payments.create_index("service_session_id")
+    await db[ROLLUP_COLLECTION].create_index([("workshop_id", 1), ("customer_id", 1)], unique=True)
+    await db.service_sessions.create_index([("workshop_id", 1), ("session_date", 1), ("id", 1)])
+
+
+async def _copy(collection, documents):
+    """Insert documents, ignoring ones a previous interrupted run already copied"""
+    if not documents:
+        return
+    try:
+        await collection.insert_many(documents, ordered=False)
+    except BulkWriteError as error:
+        if any(e["code"] != DUPLICATE_KEY_ERROR for e in error.details["writeErrors"]):
+            raise
+
+
+async def _delete_copied(collection, documents):
+    """Delete documents from the hot tier unless they changed since they were copied"""
+    if documents:
+        await collection.bulk_write([
+            DeleteOne({"id": document["id"], "updated_at": document.get("updated_at")}) for document in documents
+        ], ordered=False)
+
+
+async def _unarchive(db, workshop_id: str, session_ids):
+    """Move sessions and their archived children back to the hot tier"""
+    scope = {"workshop_id": workshop_id, "service_session_id": {"$in": session_ids}}
+    for hot, archive in [("services", "archived_services"), ("payments", "archived_payments")]:
+        copies = await db[archive].find(scope, {"_id": 0, "archived_at": 0}).to_list(None)
+        # Children edited meanwhile are still in the hot tier in their newer version
+        still_hot = set(await db[hot].distinct("id", {"id": {"$in": [copy["id"] for copy in copies]}}))
+        restored = [copy for copy in copies if copy["id"] not in still_hot]
+        if restored:
+            await db[hot].insert_many(restored)
+        await db[archive].delete_many(scope)
+    await db.archived_service_sessions.delete_many({"workshop_id": workshop_id, "id": {"$in": session_ids}})
+
+
+async def _totals_by_session(collection, session_ids, amount_field):
+    rows = await collection.aggregate([
+        {"$match": {"service_session_id": {"$in": session_ids}}},
+        {"$group": {"_id": "$service_session_id", "total": {"$sum": f"${amount_field}"}}},
+    ]).to_list(None)
+    return {row["_id"]: row["total"] for row in rows}
+
+
+async def refresh_rollups(db, workshop_id: str, customer_ids):
+    """Recompute archive rollups of the given customers from the archive collections"""
+    for customer_id in customer_ids:
+        scope = {"workshop_id": workshop_id, "customer_id": customer_id}
+        sessions = await db.archived_service_sessions.aggregate([
+            {"$match": scope},
+            {"$group": {"_id": None, "count": {"$sum": 1}, "last_session_date": {"$max": "$session_date"}}},
+        ]).to_list(1)
+        services = await db.archived_services.aggregate([
+            {"$match": scope},
+            {"$group": {"_id": None, "count": {"$sum": 1}, "total": {"$sum": "$price"}}},
+        ]).to_list(1)
+        payments = await db.archived_payments.aggregate([
+            {"$match": scope},
+            {"$group": {"_id": None, "count": {"$sum": 1}, "total": {"$sum": "$amount"}}},
+        ]).to_list(1)
+
+        sessions = sessions[0] if sessions else {"count": 0, "last_session_date": None}
+        services = services[0] if services else {"count": 0, "total": 0}
+        payments = payments[0] if payments else {"count": 0, "total": 0}
+        await db[ROLLUP_COLLECTION].update_one(scope, {"$set": {
+            "service_sessions": sessions["count"],
+            "last_session_date": sessions["last_session_date"],
+            "services": services["count"],
+            "services_total": services["total"],
+            "payments": payments["count"],
+            "payments_total": payments["total"],
+            "stale": False,
+            "refreshed_at": datetime.utcnow(),
+        }}, upsert=True)
+
+
+async def archive_settled_sessions(db, workshop_id: str, older_than: timedelta, batch_size: int = 200,
+                                   now: Optional[datetime] = None) -> dict:
+    """Move settled sessions of one workshop older than ``older_than`` into the archive"""
+    cutoff = (now or datetime.utcnow()) - older_than
+    stats = {"scanned": 0, "archived_sessions": 0, "archived_services": 0, "archived_payments": 0}
+
+    stale = await db[ROLLUP_COLLECTION].find(
+        {"workshop_id": workshop_id, "stale": True}, {"_id": 0, "customer_id": 1}
+    ).to_list(None)
+    await refresh_rollups(db, workshop_id, [rollup["customer_id"] for rollup in stale])
+
+    # Keyset scan over (session_date, id) so unsettled sessions are not revisited
+    position = None
+    while True:
+        query = {"workshop_id": workshop_id, "session_date": {"$lt": cutoff}}
+        if position:
+            query["$or"] = [
+                {"session_date": {"$gt": position[0]}},
+                {"session_date": position[0], "id": {"$gt": position[1]}},
+            ]
+        candidates = await db.service_sessions.find(query, {"_id": 0}).sort(
+            [("session_date", 1), ("id", 1)]
+        ).to_list(batch_size)
+        if not candidates:
+            break
+        stats["scanned"] += len(candidates)
+        position = (candidates[-1]["session_date"], candidates[-1]["id"])
+
+        candidate_ids = [session["id"] for session in candidates]
+        services_totals = await _totals_by_session(db.services, candidate_ids, "price")
+        payments_totals = await _totals_by_session(db.payments, candidate_ids, "amount")
+        settled = [
+            session for session in candidates
+            if services_totals.get(session["id"], 0) - payments_totals.get(session["id"], 0) <= SETTLED_TOLERANCE
+        ]
+        if not settled:
+            continue
+
+        settled_ids = [session["id"] for session in settled]
+        children_filter = {"workshop_id": workshop_id, "service_session_id": {"$in": settled_ids}}
+        services = await db.services.find(children_filter, {"_id": 0}).to_list(None)
+        payments = await db.payments.find(children_filter, {"_id": 0}).to_list(None)
+
+        archived_at = datetime.utcnow()
+        await _copy(db.archived_service_sessions, [{**s, "archived_at": archived_at} for s in settled])
+        await _copy(db.archived_services, [{**s, "archived_at": archived_at} for s in services])
+        await _copy(db.archived_payments, [{**p, "archived_at": archived_at} for p in payments])
+
+        customer_ids = sorted({session["customer_id"] for session in settled})
+        await db[ROLLUP_COLLECTION].bulk_write([
+            UpdateOne({"workshop_id": workshop_id, "customer_id": customer_id}, {"$set": {"stale": True}}, upsert=True)
+            for customer_id in customer_ids
+        ], ordered=False)
+
+        await _delete_copied(db.services, services)
+        await _delete_copied(db.payments, payments)
+
+        # Whatever is left was added or edited after the copy: the session may
+        # no longer be settled, so it stays in the hot tier
+        changed = set(await db.services.distinct("service_session_id", children_filter))
+        changed |= set(await db.payments.distinct("service_session_id", children_filter))
+        if changed:
+            logger.info("Not archiving %d sessions of %s changed during the run", len(changed), workshop_id)
+            await _unarchive(db, workshop_id, sorted(changed))
+        archived_ids = [session_id for session_id in settled_ids if session_id not in changed]
+        await db.service_sessions.delete_many({"workshop_id": workshop_id, "id": {"$in": archived_ids}})
+
+        await refresh_rollups(db, workshop_id, customer_ids)
+
+        stats["archived_sessions"] += len(archived_ids)
+        stats["archived_services"] += sum(1 for s in services if s["service_session_id"] not in changed)
+        stats["archived_payments"] += sum(1 for p in payments if p["service_session_id"] not in changed)
+
+    logger.info("Archived workshop %s: %s", workshop_id, stats)
+    return stats
@@ -0,0 +1,125 @@
+"""Coalescing of concurrent inserts into one round trip per collection.
+
+``InsertBatcher.insert`` queues a document and waits for it to be written.
+Queued documents of a collection are flushed with one unordered
+``insert_many`` once ``window`` seconds have passed since the first of them
+arrived, or as soon as ``max_batch`` are waiting. A single insert therefore
+waits at most ``window`` longer than with ``insert_one``.
+
+Every caller gets its own outcome: a document rejected by the server (for
+example a duplicate key) raises the same error ``insert_one`` would have
+raised, without failing the other documents in its batch.
+"""
+import asyncio
+import logging
+from collections import Counter
+from typing import Dict, List, Tuple
+
+from pymongo.errors import BulkWriteError, DuplicateKeyError, WriteError
+
+logger = logging.getLogger(__name__)
+
+DUPLICATE_KEY_CODES = {11000, 11001, 12582}
+# Batch size histogram buckets, by upper bound
+SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+BUCKET_LABELS = [f"<={bound}" for bound in SIZE_BUCKETS] + [f">{SIZE_BUCKETS[-1]}"]
+
+
+def _bucket(size: int) -> str:
+    return next((f"<={bound}" for bound in SIZE_BUCKETS if size <= bound), BUCKET_LABELS[-1])
+
+
+def _write_error(error: dict) -> WriteError:
+    error_type = DuplicateKeyError if error.get("code") in DUPLICATE_KEY_CODES else WriteError
+    return error_type(error.get("errmsg"), error.get("code"), error)
+
+
+class InsertBatcher:
+    def __init__(self, db, window: float = 0.002, max_batch: int = 100, enabled: bool = True):
+        self.db = db
+        self.window = window
+        self.max_batch = max_batch
+        self.enabled = enabled
+        self._pending: Dict[str, List[Tuple[dict, asyncio.Future]]] = {}
+        self._timers: Dict[str, asyncio.TimerHandle] = {}
+        self._flushes = set()
+        self.counters = Counter()
+        self.sizes = Counter()
+
+    async def insert(self, collection: str, document: dict):
+        """Insert ``document`` into ``collection``, batched with concurrent inserts"""
+        if not self.enabled:
+            await self.db[collection].insert_one(document)
+            return
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        pending = self._pending.setdefault(collection, [])
+        pending.append((document, future))
+        if len(pending) >= self.max_batch:
+            self.counters["flushed_full"] += 1
+            self._start_flush(collection)
+        elif collection not in self._timers:
+            self._timers[collection] = loop.call_later(self.window, self._flush_on_timer, collection)
+        await future
+
+    def _flush_on_timer(self, collection: str):
+        self._timers.pop(collection, None)
+        if self._pending.get(collection):
+            self.counters["flushed_window"] += 1
+            self._start_flush(collection)
+
+    def _start_flush(self, collection: str):
+        timer = self._timers.pop(collection, None)
+        if timer is not None:
+            timer.cancel()
+        batch = self._pending.pop(collection, [])
+        task = asyncio.ensure_future(self._flush(collection, batch))
+        self._flushes.add(task)
+        task.add_done_callback(self._flushes.discard)
+
+    async def _flush(self, collection: str, batch: List[Tuple[dict, asyncio.Future]]):
+        self.counters["batches"] += 1
+        self.counters["documents"] += len(batch)
+        self.sizes[_bucket(len(batch))] += 1
+
+        errors = {}
+        try:
+            await self.db[collection].insert_many([document for document, _ in batch], ordered=False)
+        except BulkWriteError as error:
+            errors = {write_error["index"]: _write_error(write_error) for write_error in error.details["writeErrors"]}
+        except Exception as error:
+            logger.warning("Batched insert of %d documents into %s failed: %s", len(batch), collection, error)
+            errors = {index: error for index in range(len(batch))}
+
+        self.counters["failed_documents"] += len(errors)
+        for index, (_, future) in enumerate(batch):
+            # A caller that was cancelled no longer waits for its outcome
+            if future.done():
+                continue
+            if index in errors:
+                future.set_exception(errors[index])
+            else:
+                future.set_result(None)
+
+    async def close(self):
+        """Flush everything still queued"""
+        for collection in list(self._pending):
+            self._start_flush(collection)
+        if self._flushes:
+            await asyncio.gather(*self._flushes, return_exceptions=True)
+
+    def stats(self) -> dict:
+        batches = self.counters["batches"]
+        return {
+            "enabled": self.enabled,
+            "window_ms": self.window * 1000,
+            "max_batch": self.max_batch,
+            "batches": batches,
+            "documents": self.counters["documents"],
+            "mean_batch_size": self.counters["documents"] / batches if batches else 0.0,
+            "flushed_full": self.counters["flushed_full"],
+            "flushed_window": self.counters["flushed_window"],
+            "failed_documents": self.counters["failed_documents"],
+            "batch_sizes": {label: self.sizes[label] for label in BUCKET_LABELS if self.sizes[label]},
+        }
@@ -0,0 +1,56 @@
+"""Totals of an owner's branch workshops.
+
+An owner may link the workshops of other owner accounts as branches and see
+one dashboard for all of them. Each branch is summed by the same three
+aggregations, each starting with a ``workshop_id`` match that an index
+serves:
+
+* customers, covered by the ``(workshop_id, total_debt)`` index,
+* payments, covered by the ``(workshop_id, amount)`` index,
+* the archive rollups, which hold the payments already archived.
+
+``branch_totals`` runs the three concurrently, and the dashboard runs all
+branches concurrently, so it takes as long as the slowest branch.
+"""
+import asyncio
+from typing import Dict, List
+
+from archive import ROLLUP_COLLECTION
+
+TOTAL_FIELDS = ["customers", "customers_in_debt", "total_debt", "payments", "revenue"]
+
+
+async def _group(collection, workshop_id: str, group: dict) -> dict:
+    results = await collection.aggregate([
+        {"$match": {"workshop_id": workshop_id}},
+        {"$group": {"_id": None, **group}},
+    ]).to_list(1)
+    return results[0] if results else {}
+
+
+async def branch_totals(db, workshop_id: str) -> Dict[str, float]:
+    """Customer count, outstanding debt and revenue of one workshop"""
+    customers, payments, archived = await asyncio.gather(
+        _group(db.customers, workshop_id, {
+            "customers": {"$sum": 1},
+            "customers_in_debt": {"$sum": {"$cond": [{"$gt": ["$total_debt", 0]}, 1, 0]}},
+            # Customers who paid in advance do not offset the others' debt
+            "total_debt": {"$sum": {"$max": ["$total_debt", 0]}},
+        }),
+        _group(db.payments, workshop_id, {"payments": {"$sum": 1}, "revenue": {"$sum": "$amount"}}),
+        _group(db[ROLLUP_COLLECTION], workshop_id, {
+            "payments": {"$sum": "$payments"}, "revenue": {"$sum": "$payments_total"},
+        }),
+    )
+    return {
+        "customers": customers.get("customers", 0),
+        "customers_in_debt": customers.get("customers_in_debt", 0),
+        "total_debt": customers.get("total_debt", 0),
+        "payments": payments.get("payments", 0) + archived.get("payments", 0),
+        "revenue": payments.get("revenue", 0) + archived.get("revenue", 0),
+    }
+
+
+def merge_totals(branches: List[dict]) -> Dict[str, float]:
+    """Sum the totals of several branches"""
+    return {field: sum(branch[field] for branch in branches) for field in TOTAL_FIELDS}
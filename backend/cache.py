@@ -0,0 +1,131 @@
+"""Response cache for read-heavy endpoints.
+
+Entries are keyed by workshop, endpoint and request parameters, and each entry
+is tagged (for example ``customer:<id>``) so write handlers can invalidate
+exactly the responses they affect.
+
+``InMemoryCacheBackend`` is a size-bounded LRU local to one worker process.
+Deployments running several workers can plug in a shared implementation of
+``CacheBackend``. Invalidation then has to reach every worker.
+"""
+from collections import Counter, OrderedDict
+from typing import Any, Hashable, Iterable, Tuple
+
+
+class CacheBackend:
+    """Storage for cached responses.
+
+    ``get`` returns ``MISSING`` when there is no entry. ``invalidate`` drops
+    every entry of the workshop carrying any of the given tags.
+    """
+
+    async def get(self, key: Hashable) -> Any:
+        raise NotImplementedError
+
+    async def set(self, key: Hashable, value: Any, workshop_id: str, tags: Iterable[str]) -> None:
+        raise NotImplementedError
+
+    async def invalidate(self, workshop_id: str, tags: Iterable[str]) -> int:
+        raise NotImplementedError
+
+    def stats(self) -> dict:
+        raise NotImplementedError
+
+
+MISSING = object()
+
+
+class InMemoryCacheBackend(CacheBackend):
+    def __init__(self, max_entries: int = 1000):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Hashable, Tuple[Any, str, frozenset]]" = OrderedDict()
+        # (workshop_id, tag) -> keys carrying that tag
+        self._tagged = {}
+        self.counters = Counter()
+
+    async def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            self.counters["misses"] += 1
+            return MISSING
+        self._entries.move_to_end(key)
+        self.counters["hits"] += 1
+        return entry[0]
+
+    async def set(self, key, value, workshop_id, tags):
+        self._remove(key)
+        tags = frozenset(tags)
+        self._entries[key] = (value, workshop_id, tags)
+        for tag in tags:
+            self._tagged.setdefault((workshop_id, tag), set()).add(key)
+        while len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)))
+            self.counters["evictions"] += 1
+
+    async def invalidate(self, workshop_id, tags):
+        keys = set()
+        for tag in tags:
+            keys |= self._tagged.get((workshop_id, tag), set())
+        for key in keys:
+            self._remove(key)
+        self.counters["invalidations"] += len(keys)
+        return len(keys)
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        _, workshop_id, tags = entry
+        for tag in tags:
+            keys = self._tagged.get((workshop_id, tag))
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tagged[(workshop_id, tag)]
+
+    def stats(self):
+        lookups = self.counters["hits"] + self.counters["misses"]
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.counters["hits"],
+            "misses": self.counters["misses"],
+            "hit_ratio": self.counters["hits"] / lookups if lookups else 0.0,
+            "evictions": self.counters["evictions"],
+            "invalidations": self.counters["invalidations"],
+        }
+
+
+class ResponseCache:
+    def __init__(self, backend: CacheBackend, enabled: bool = True):
+        self.backend = backend
+        self.enabled = enabled
+        # Bumped on every invalidation so a response computed concurrently
+        # with a write is not stored after the write invalidated it
+        self._generations = Counter()
+
+    @staticmethod
+    def key(workshop_id: str, endpoint: str, **params) -> Tuple:
+        return (workshop_id, endpoint, tuple(sorted(params.items())))
+
+    async def get_or_compute(self, workshop_id: str, endpoint: str, params: dict, tags: Iterable[str], compute):
+        """Return the cached response, computing and storing it on a miss"""
+        if not self.enabled:
+            return await compute()
+        key = self.key(workshop_id, endpoint, **params)
+        value = await self.backend.get(key)
+        if value is MISSING:
+            generation = self._generations[workshop_id]
+            value = await compute()
+            if self._generations[workshop_id] == generation:
+                await self.backend.set(key, value, workshop_id, tags)
+        return value
+
+    async def invalidate(self, workshop_id: str, *tags: str) -> int:
+        if not self.enabled:
+            return 0
+        self._generations[workshop_id] += 1
+        return await self.backend.invalidate(workshop_id, tags)
+
+    def stats(self) -> dict:
+        return {"enabled": self.enabled, **self.backend.stats()}
@@ -0,0 +1,98 @@
+"""MongoDB client configuration.
+
+All settings come from environment variables so deployments can tune the
+connection pool without code changes:
+
+``MONGO_MAX_POOL_SIZE`` / ``MONGO_MIN_POOL_SIZE``
+    Connections kept per server (defaults 100 / 0).
+``MONGO_MAX_IDLE_TIME_MS``
+    Close pooled connections idle for longer than this.
+``MONGO_WAIT_QUEUE_TIMEOUT_MS``
+    How long a request waits for a free pooled connection before failing.
+``MONGO_SERVER_SELECTION_TIMEOUT_MS`` / ``MONGO_CONNECT_TIMEOUT_MS`` / ``MONGO_SOCKET_TIMEOUT_MS``
+    Network timeouts.
+``MONGO_COMPRESSORS`` / ``MONGO_ZLIB_COMPRESSION_LEVEL``
+    Wire compression, e.g. ``zstd,zlib``.
+``MONGO_READ_PREFERENCE`` / ``MONGO_READ_MAX_STALENESS_SECONDS``
+    Read preference of the read-only handle used by read-heavy endpoints
+    (default ``secondaryPreferred`` with a 90 second staleness bound).
+
+Writes always go through the primary. Both database handles share one
+client, and therefore one connection pool per server.
+"""
+import os
+from typing import Mapping, Optional
+
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.read_preferences import (
+    Nearest,
+    Primary,
+    PrimaryPreferred,
+    Secondary,
+    SecondaryPreferred,
+)
+
+# MongoDB rejects staleness bounds below 90 seconds
+MIN_MAX_STALENESS_SECONDS = 90
+
+_READ_PREFERENCES = {
+    'primary': Primary,
+    'primaryPreferred': PrimaryPreferred,
+    'secondary': Secondary,
+    'secondaryPreferred': SecondaryPreferred,
+    'nearest': Nearest,
+}
+
+_INT_OPTIONS = {
+    'MONGO_MAX_POOL_SIZE': 'maxPoolSize',
+    'MONGO_MIN_POOL_SIZE': 'minPoolSize',
+    'MONGO_MAX_IDLE_TIME_MS': 'maxIdleTimeMS',
+    'MONGO_WAIT_QUEUE_TIMEOUT_MS': 'waitQueueTimeoutMS',
+    'MONGO_SERVER_SELECTION_TIMEOUT_MS': 'serverSelectionTimeoutMS',
+    'MONGO_CONNECT_TIMEOUT_MS': 'connectTimeoutMS',
+    'MONGO_SOCKET_TIMEOUT_MS': 'socketTimeoutMS',
+    'MONGO_ZLIB_COMPRESSION_LEVEL': 'zlibCompressionLevel',
+}
+
+_DEFAULTS = {
+    'maxPoolSize': 100,
+    'minPoolSize': 0,
+    'waitQueueTimeoutMS': 5000,
+    'serverSelectionTimeoutMS': 5000,
+}
+
+
+def client_options(env: Mapping[str, str] = os.environ) -> dict:
+    """Build keyword arguments for ``AsyncIOMotorClient`` from the environment."""
+    options = dict(_DEFAULTS)
+    for env_name, option in _INT_OPTIONS.items():
+        if env.get(env_name):
+            options[option] = int(env[env_name])
+    if env.get('MONGO_COMPRESSORS'):
+        options['compressors'] = env['MONGO_COMPRESSORS']
+    if env.get('MONGO_APP_NAME'):
+        options['appname'] = env['MONGO_APP_NAME']
+    return options
+
+
+def read_preference(env: Mapping[str, str] = os.environ):
+    """Read preference for read-heavy endpoints."""
+    mode = env.get('MONGO_READ_PREFERENCE', 'secondaryPreferred')
+    if mode not in _READ_PREFERENCES:
+        raise ValueError(f"Unknown MONGO_READ_PREFERENCE: {mode}")
+    if mode == 'primary':
+        return Primary()
+
+    max_staleness = int(env.get('MONGO_READ_MAX_STALENESS_SECONDS', MIN_MAX_STALENESS_SECONDS))
+    if max_staleness != -1 and max_staleness < MIN_MAX_STALENESS_SECONDS:
+        raise ValueError(f"MONGO_READ_MAX_STALENESS_SECONDS must be -1 or at least {MIN_MAX_STALENESS_SECONDS}")
+    return _READ_PREFERENCES[mode](max_staleness=max_staleness)
+
+
+def create_client(mongo_url: str, env: Mapping[str, str] = os.environ, **overrides) -> AsyncIOMotorClient:
+    return AsyncIOMotorClient(mongo_url, **{**client_options(env), **overrides})
+
+
+def read_database(client: AsyncIOMotorClient, name: str, env: Mapping[str, str] = os.environ, preference: Optional[object] = None):
+    """Database handle that routes reads according to ``read_preference``."""
+    return client.get_database(name, read_preference=preference or read_preference(env))
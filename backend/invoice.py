@@ -0,0 +1,211 @@
+"""Printable invoices for service sessions.
+
+``render_invoice`` writes a small PDF directly, using only the standard
+Type 1 fonts every viewer has, so no PDF library is needed. Rendering is
+CPU-bound, so ``InvoiceRenderer`` runs it in a process pool. Its workers are
+started and warmed before traffic arrives. Rendered documents are cached by
+the caller's data version, so downloading an unchanged invoice again costs
+nothing.
+"""
+import asyncio
+import multiprocessing
+import textwrap
+from collections import Counter, OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Hashable, List, Optional
+
+PAGE_WIDTH, PAGE_HEIGHT = 595, 842  # A4 in points
+MARGIN = 50
+FONTS = {"F1": "Helvetica", "F2": "Helvetica-Bold", "F3": "Courier"}
+DESCRIPTION_WIDTH = 60  # characters per line before wrapping
+
+
+def format_rupiah(amount: float) -> str:
+    return f"Rp {amount:,.0f}"
+
+
+def _pdf_string(text: str) -> bytes:
+    # Standard fonts only cover WinAnsi; anything else (emoji) prints as '?'
+    data = text.encode("cp1252", errors="replace")
+    return b"(" + data.replace(b"\\", b"\\\\").replace(b"(", b"\\(").replace(b")", b"\\)") + b")"
+
+
+class _Canvas:
+    def __init__(self):
+        self.pages: List[List[bytes]] = []
+        self.new_page()
+
+    def new_page(self):
+        self._ops = []
+        self.pages.append(self._ops)
+        self.y = PAGE_HEIGHT - MARGIN
+
+    def text(self, x: float, text: str, font: str = "F1", size: int = 10):
+        self._ops.append(b"BT /%s %d Tf %.2f %.2f Td %s Tj ET" % (font.encode(), size, x, self.y, _pdf_string(text)))
+
+    def amount(self, amount_text: str, size: int = 10):
+        # Courier glyphs are 0.6 em wide, which makes right alignment exact
+        self.text(PAGE_WIDTH - MARGIN - len(amount_text) * size * 0.6, amount_text, "F3", size)
+
+    def rule(self):
+        self._ops.append(b"%d %.2f m %d %.2f l S" % (MARGIN, self.y + 4, PAGE_WIDTH - MARGIN, self.y + 4))
+        self.y -= 8
+
+    def row(self, label: str, amount: Optional[float] = None, font: str = "F1", size: int = 10, height: int = 14):
+        if self.y < MARGIN + height:
+            self.new_page()
+        self.text(MARGIN, label, font, size)
+        if amount is not None:
+            self.amount(format_rupiah(amount), size)
+        self.y -= height
+
+    def gap(self, height: int = 8):
+        self.y -= height
+
+
+def _write_pdf(pages: List[List[bytes]]) -> bytes:
+    font_ids = {name: 3 + index for index, name in enumerate(FONTS)}
+    first_page_id = 3 + len(FONTS)
+    page_ids = [first_page_id + 2 * index for index in range(len(pages))]
+    fonts = b" ".join(b"/%s %d 0 R" % (name.encode(), object_id) for name, object_id in font_ids.items())
+
+    objects = {
+        1: b"<< /Type /Catalog /Pages 2 0 R >>",
+        2: b"<< /Type /Pages /Kids [%s] /Count %d >>" % (
+            b" ".join(b"%d 0 R" % page_id for page_id in page_ids), len(pages)
+        ),
+    }
+    for name, object_id in font_ids.items():
+        objects[object_id] = b"<< /Type /Font /Subtype /Type1 /BaseFont /%s /Encoding /WinAnsiEncoding >>" % (
+            FONTS[name].encode()
+        )
+    for page_id, operations in zip(page_ids, pages):
+        content = b"\n".join(operations)
+        objects[page_id] = b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %d %d] /Resources << /Font << %s >> >> /Contents %d 0 R >>" % (
+            PAGE_WIDTH, PAGE_HEIGHT, fonts, page_id + 1
+        )
+        objects[page_id + 1] = b"<< /Length %d >>\nstream\n%s\nendstream" % (len(content), content)
+
+    output = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for object_id in sorted(objects):
+        offsets.append(len(output))
+        output += b"%d 0 obj\n%s\nendobj\n" % (object_id, objects[object_id])
+    xref = len(output)
+    output += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    output += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    output += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return bytes(output)
+
+
+def render_invoice(invoice: dict) -> bytes:
+    """Render one session's invoice.
+
+    ``invoice`` holds ``workshop_name``, ``customer`` (name, phone),
+    ``session`` (id, session_name, session_date), ``services`` and
+    ``payments`` as stored in the database.
+    """
+    canvas = _Canvas()
+    session = invoice["session"]
+    customer = invoice["customer"]
+
+    canvas.row(invoice["workshop_name"], font="F2", size=16, height=22)
+    canvas.row("NOTA SERVIS", font="F2", size=12, height=20)
+    canvas.row(f"No. {session['id'][:8].upper()}")
+    canvas.row(f"Pelanggan: {customer['name']} ({customer['phone']})")
+    canvas.row(f"Servis: {session['session_name']}")
+    canvas.row(f"Tanggal: {session['session_date'].strftime('%d/%m/%Y')}")
+    canvas.gap()
+
+    canvas.row("DETAIL SERVIS", font="F2")
+    canvas.rule()
+    for service in invoice["services"]:
+        lines = textwrap.wrap(service["description"], DESCRIPTION_WIDTH) or [""]
+        canvas.row(lines[0], service["price"])
+        for line in lines[1:]:
+            canvas.row(line)
+    services_total = sum(service["price"] for service in invoice["services"])
+    canvas.rule()
+    canvas.row("Total Servis", services_total, font="F2")
+    canvas.gap()
+
+    payments_total = sum(payment["amount"] for payment in invoice["payments"])
+    if invoice["payments"]:
+        canvas.row("PEMBAYARAN", font="F2")
+        canvas.rule()
+        for payment in invoice["payments"]:
+            description = f" - {payment['description']}" if payment.get("description") else ""
+            canvas.row(f"{payment['payment_date'].strftime('%d/%m/%Y')}{description}", payment["amount"])
+        canvas.rule()
+        canvas.row("Total Bayar", payments_total, font="F2")
+        canvas.gap()
+
+    remaining = services_total - payments_total
+    if remaining > 0:
+        canvas.row("Sisa", remaining, font="F2", size=12, height=18)
+    else:
+        canvas.row("LUNAS", font="F2", size=12, height=18)
+    canvas.gap(16)
+    canvas.row(f"Terima kasih telah mempercayakan kendaraan Anda kepada {invoice['workshop_name']}.", size=9)
+    return _write_pdf(canvas.pages)
+
+
+def warm_up() -> int:
+    """Render a sample invoice so a fresh worker has imported and run everything"""
+    now = datetime.utcnow()
+    return len(render_invoice({
+        "workshop_name": "Bengkel",
+        "customer": {"name": "-", "phone": "-"},
+        "session": {"id": "00000000", "session_name": "-", "session_date": now},
+        "services": [{"description": "-", "price": 0}],
+        "payments": [{"amount": 0, "description": None, "payment_date": now}],
+    }))
+
+
+class InvoiceRenderer:
+    def __init__(self, max_workers: int = 2, max_entries: int = 500):
+        self.max_workers = max_workers
+        self.max_entries = max_entries
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._cache: "OrderedDict[Hashable, bytes]" = OrderedDict()
+        # Concurrent requests for the same invoice share one render
+        self._pending = {}
+        self.counters = Counter()
+
+    async def start(self):
+        # Spawned workers do not inherit the event loop and driver threads of this process
+        self._pool = ProcessPoolExecutor(self.max_workers, mp_context=multiprocessing.get_context("spawn"))
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*[loop.run_in_executor(self._pool, warm_up) for _ in range(self.max_workers)])
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    async def render(self, key: Hashable, invoice: dict) -> bytes:
+        """Return the cached document for ``key``, rendering ``invoice`` on a miss"""
+        document = self._cache.get(key)
+        if document is not None:
+            self._cache.move_to_end(key)
+            self.counters["hits"] += 1
+            return document
+
+        pending = self._pending.get(key)
+        if pending is None:
+            self.counters["renders"] += 1
+            loop = asyncio.get_running_loop()
+            pending = asyncio.ensure_future(loop.run_in_executor(self._pool, render_invoice, invoice))
+            self._pending[key] = pending
+            pending.add_done_callback(lambda _: self._pending.pop(key, None))
+        document = await asyncio.shield(pending)
+
+        self._cache[key] = document
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.max_entries:
+            self._cache.popitem(last=False)
+        return document
+
+    def stats(self) -> dict:
+        return {"workers": self.max_workers, "cached": len(self._cache), **self.counters}
@@ -0,0 +1,181 @@
+"""Background job queue backed by a MongoDB collection.
+
+Jobs are persisted in ``jobs`` and claimed atomically, so several worker
+processes can share one queue and a restart does not lose queued work. Each
+process runs a fixed number of worker tasks, which bounds how much slow work
+competes with request handling on the event loop.
+
+A claimed job holds a lease, renewed while the handler runs. If its process
+dies, the job is claimed again once the lease expires, so handlers must be
+idempotent. Outcomes are only recorded while the worker still holds the
+lease, so a worker that lost it cannot overwrite the new owner's result. Failed attempts are
+retried with exponential backoff until ``max_attempts`` is reached.
+"""
+import asyncio
+import logging
+import uuid
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, Optional
+
+from pymongo import ReturnDocument
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+RUNNING = "running"
+COMPLETED = "completed"
+FAILED = "failed"
+
+Handler = Callable[[dict], Awaitable[object]]
+
+
+class UnknownJobType(ValueError):
+    pass
+
+
+class JobQueue:
+    def __init__(
+        self,
+        collection,
+        concurrency: int = 2,
+        max_attempts: int = 3,
+        backoff_seconds: float = 2.0,
+        lease_seconds: float = 600,
+        poll_interval: float = 1.0,
+    ):
+        self.collection = collection
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self.backoff_seconds = backoff_seconds
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.handlers: Dict[str, Handler] = {}
+        self._wakeup = asyncio.Event()
+        self._workers = []
+
+    def register(self, job_type: str, handler: Handler):
+        self.handlers[job_type] = handler
+
+    async def ensure_indexes(self, retention_days: int = 7):
+        await self.collection.create_index("id", unique=True)
+        await self.collection.create_index([("status", 1), ("run_at", 1)])
+        await self.collection.create_index("finished_at", expireAfterSeconds=retention_days * 24 * 3600)
+
+    async def submit(self, job_type: str, params: dict, workshop_id: str, created_by: Optional[str] = None) -> dict:
+        if job_type not in self.handlers:
+            raise UnknownJobType(job_type)
+        now = datetime.utcnow()
+        job = {
+            "id": str(uuid.uuid4()),
+            "type": job_type,
+            "params": params,
+            "workshop_id": workshop_id,
+            "created_by": created_by,
+            "status": QUEUED,
+            "attempts": 0,
+            "max_attempts": self.max_attempts,
+            "run_at": now,
+            "created_at": now,
+            "updated_at": now,
+            "result": None,
+            "error": None,
+        }
+        await self.collection.insert_one(dict(job))
+        self._wakeup.set()
+        return job
+
+    async def get(self, job_id: str, workshop_id: str) -> Optional[dict]:
+        return await self.collection.find_one({"id": job_id, "workshop_id": workshop_id}, {"_id": 0})
+
+    async def claim(self) -> Optional[dict]:
+        now = datetime.utcnow()
+        return await self.collection.find_one_and_update(
+            {"$or": [
+                {"status": QUEUED, "run_at": {"$lte": now}},
+                {"status": RUNNING, "lease_expires_at": {"$lt": now}},
+            ]},
+            {
+                "$set": {
+                    "status": RUNNING,
+                    "started_at": now,
+                    "updated_at": now,
+                    "lease_id": str(uuid.uuid4()),
+                    "lease_expires_at": now + timedelta(seconds=self.lease_seconds),
+                },
+                "$inc": {"attempts": 1},
+            },
+            sort=[("run_at", 1)],
+            projection={"_id": 0},
+            return_document=ReturnDocument.AFTER,
+        )
+
+    async def _renew_lease(self, job: dict):
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            try:
+                result = await self.collection.update_one(
+                    {"id": job["id"], "lease_id": job["lease_id"]},
+                    {"$set": {"lease_expires_at": datetime.utcnow() + timedelta(seconds=self.lease_seconds)}},
+                )
+            except Exception:
+                logger.exception("Renewing the lease of job %s failed", job["id"])
+                continue
+            if not result.matched_count:
+                logger.warning("Job %s (%s) lost its lease to another worker", job["id"], job["type"])
+                return
+
+    async def run_job(self, job: dict):
+        renewal = asyncio.ensure_future(self._renew_lease(job))
+        try:
+            result = await self.handlers[job["type"]](job)
+        except Exception as error:
+            now = datetime.utcnow()
+            if job["attempts"] < job["max_attempts"]:
+                delay = self.backoff_seconds * 2 ** (job["attempts"] - 1)
+                logger.warning("Job %s (%s) failed, retrying in %.0fs: %s", job["id"], job["type"], delay, error)
+                update = {"status": QUEUED, "run_at": now + timedelta(seconds=delay)}
+            else:
+                logger.exception("Job %s (%s) failed permanently", job["id"], job["type"])
+                update = {"status": FAILED, "finished_at": now}
+            update.update({"error": str(error), "updated_at": now})
+        else:
+            now = datetime.utcnow()
+            update = {"status": COMPLETED, "result": result, "error": None, "finished_at": now, "updated_at": now}
+        finally:
+            renewal.cancel()
+
+        recorded = await self.collection.update_one(
+            {"id": job["id"], "lease_id": job["lease_id"]},
+            {"$set": update, "$unset": {"lease_id": "", "lease_expires_at": ""}},
+        )
+        if not recorded.matched_count:
+            logger.warning("Job %s (%s) finished after losing its lease; outcome not recorded", job["id"], job["type"])
+
+    async def _worker(self):
+        while True:
+            try:
+                job = await self.claim()
+            except Exception:
+                logger.exception("Claiming a job failed")
+                job = None
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            try:
+                await self.run_job(job)
+            except Exception:
+                # Its lease expires and another worker claims it again
+                logger.exception("Recording the outcome of job %s (%s) failed", job["id"], job["type"])
+
+    def start(self):
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.concurrency)]
+
+    async def stop(self):
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
@@ -0,0 +1,132 @@
+"""Opt-in statistical profiler for individual requests.
+
+A helper thread samples the event-loop thread's Python stack at a fixed
+interval while a request is being served, then writes the samples as
+collapsed stacks (``root;caller;callee count`` per line). That format is read
+directly by flamegraph.pl, inferno and speedscope.
+
+The sampler observes the whole event-loop thread, so concurrently running
+requests show up in the same profile. Time spent waiting on Mongo appears as
+the selector's ``select`` frame.
+
+The middleware is only installed when profiling is configured, so a
+deployment without profiling settings pays nothing for it.
+"""
+import asyncio
+import hmac
+import logging
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    name = getattr(code, 'co_qualname', code.co_name)
+    return f"{name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class StackSampler:
+    """Collects stack samples of one thread until stopped."""
+
+    def __init__(self, thread_id: int, interval: float = 0.005):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples: Counter = Counter()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(_frame_label(frame))
+                frame = frame.f_back
+            if stack:
+                self.samples[";".join(reversed(stack))] += 1
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self) -> Counter:
+        self._stopped.set()
+        self._thread.join()
+        return self.samples
+
+
+class ProfilingMiddleware:
+    """ASGI middleware that profiles selected requests.
+
+    A request is profiled when it carries an ``X-Profile`` header together with
+    an ``X-Admin-Token`` header equal to ``admin_token``, or when it is picked
+    by random sampling at ``sample_rate``. Only the newest ``max_files``
+    profiles are kept in ``output_dir``.
+    """
+
+    def __init__(
+        self,
+        app,
+        output_dir: str,
+        admin_token: Optional[str] = None,
+        sample_rate: float = 0.0,
+        interval: float = 0.005,
+        max_files: int = 200,
+    ):
+        self.app = app
+        self.output_dir = Path(output_dir)
+        self.admin_token = admin_token
+        self.sample_rate = sample_rate
+        self.interval = interval
+        self.max_files = max_files
+
+    def _should_profile(self, scope) -> bool:
+        if self.admin_token:
+            headers = dict(scope.get("headers") or [])
+            if b"x-profile" in headers and hmac.compare_digest(
+                headers.get(b"x-admin-token", b""), self.admin_token.encode()
+            ):
+                return True
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self._should_profile(scope):
+            await self.app(scope, receive, send)
+            return
+
+        sampler = StackSampler(threading.get_ident(), self.interval)
+        started = time.perf_counter()
+        sampler.start()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            samples = sampler.stop()
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            await asyncio.get_running_loop().run_in_executor(
+                None, self._write_profile, scope, samples, elapsed_ms
+            )
+
+    def _write_profile(self, scope, samples: Counter, elapsed_ms: float):
+        try:
+            self.output_dir.mkdir(parents=True, exist_ok=True)
+            path_slug = re.sub(r"[^A-Za-z0-9]+", "_", scope.get("path", "")).strip("_") or "root"
+            filename = f"{time.strftime('%Y%m%dT%H%M%S')}-{time.time_ns() % 1_000_000:06d}-{scope.get('method', 'GET')}-{path_slug}-{elapsed_ms:.0f}ms.collapsed"
+            target = self.output_dir / filename
+            target.write_text("".join(f"{stack} {count}\n" for stack, count in samples.items()))
+            logger.info("Wrote request profile %s (%d samples)", target, sum(samples.values()))
+            self._enforce_retention()
+        except OSError:
+            logger.exception("Failed to write request profile")
+
+    def _enforce_retention(self):
+        profiles = sorted(self.output_dir.glob("*.collapsed"), key=lambda p: p.stat().st_mtime, reverse=True)
+        for stale in profiles[self.max_files:]:
+            stale.unlink(missing_ok=True)
@@ -0,0 +1,111 @@
+"""Rotating refresh tokens.
+
+A refresh token is ``<token id>.<secret>``. Only an HMAC-SHA256 of the secret
+is stored, so verifying one costs a single hash instead of a bcrypt check and
+a leaked collection cannot be replayed.
+
+Every sign-in starts a token family, which stands for one device. Each refresh
+spends the presented token and issues its successor in the same family. If a
+spent token is presented again, it was copied, and the whole family is
+revoked. Revoking a family signs that device out; access tokens already
+issued to it stay valid until they expire.
+"""
+import hashlib
+import hmac
+import secrets
+import uuid
+from datetime import datetime, timedelta
+from typing import List, Optional, Tuple
+
+from pymongo import ReturnDocument
+
+
+class InvalidRefreshToken(Exception):
+    pass
+
+
+def split_token(token: str) -> Tuple[str, str]:
+    token_id, separator, secret = token.partition(".")
+    if not separator or not token_id or not secret:
+        raise InvalidRefreshToken("Malformed refresh token")
+    return token_id, secret
+
+
+class RefreshTokenStore:
+    def __init__(self, collection, key: str, lifetime: timedelta = timedelta(days=30)):
+        self.collection = collection
+        self._key = key.encode()
+        self.lifetime = lifetime
+
+    def _hash(self, secret: str) -> str:
+        return hmac.new(self._key, secret.encode(), hashlib.sha256).hexdigest()
+
+    async def ensure_indexes(self):
+        await self.collection.create_index("id", unique=True)
+        await self.collection.create_index([("user_id", 1), ("family_id", 1)])
+        await self.collection.create_index("expires_at", expireAfterSeconds=0)
+
+    async def issue(self, user_id: str, device_name: Optional[str] = None, previous: Optional[dict] = None,
+                    token_id: Optional[str] = None) -> Tuple[str, dict]:
+        """Create a token, continuing the family of ``previous`` or starting a new one"""
+        token_id = token_id or str(uuid.uuid4())
+        secret = secrets.token_urlsafe(32)
+        now = datetime.utcnow()
+        record = {
+            "id": token_id,
+            "family_id": previous["family_id"] if previous else token_id,
+            "user_id": user_id,
+            "device_name": previous["device_name"] if previous else device_name,
+            "token_hash": self._hash(secret),
+            "signed_in_at": previous["signed_in_at"] if previous else now,
+            "created_at": now,
+            "expires_at": now + self.lifetime,
+            "spent_at": None,
+            "revoked_at": None,
+        }
+        await self.collection.insert_one(dict(record))
+        return f"{token_id}.{secret}", record
+
+    async def rotate(self, token: str) -> Tuple[str, dict]:
+        """Spend ``token`` and return its successor with the successor's record"""
+        token_id, secret = split_token(token)
+        record = await self.collection.find_one({"id": token_id}, {"_id": 0})
+        if record is None or not hmac.compare_digest(record["token_hash"], self._hash(secret)):
+            raise InvalidRefreshToken("Unknown refresh token")
+        if record["revoked_at"] is not None or record["expires_at"] <= datetime.utcnow():
+            raise InvalidRefreshToken("Refresh token expired or revoked")
+
+        successor_id = str(uuid.uuid4())
+        spent = await self.collection.find_one_and_update(
+            {"id": token_id, "spent_at": None, "revoked_at": None},
+            {"$set": {"spent_at": datetime.utcnow(), "replaced_by": successor_id}},
+            projection={"_id": 0, "id": 1},
+            return_document=ReturnDocument.AFTER,
+        )
+        if spent is None:
+            await self.revoke_family(record["user_id"], record["family_id"])
+            raise InvalidRefreshToken("Refresh token reused, device signed out")
+        return await self.issue(record["user_id"], previous=record, token_id=successor_id)
+
+    async def revoke(self, token: str) -> Optional[dict]:
+        """Revoke the family of ``token``, returning its record if the token was valid"""
+        token_id, secret = split_token(token)
+        record = await self.collection.find_one({"id": token_id}, {"_id": 0})
+        if record is None or not hmac.compare_digest(record["token_hash"], self._hash(secret)):
+            return None
+        await self.revoke_family(record["user_id"], record["family_id"])
+        return record
+
+    async def revoke_family(self, user_id: str, family_id: str) -> int:
+        result = await self.collection.update_many(
+            {"user_id": user_id, "family_id": family_id, "revoked_at": None},
+            {"$set": {"revoked_at": datetime.utcnow()}},
+        )
+        return result.modified_count
+
+    async def devices(self, user_id: str) -> List[dict]:
+        """The signed-in devices of a user, one entry per live token family"""
+        return await self.collection.find(
+            {"user_id": user_id, "spent_at": None, "revoked_at": None, "expires_at": {"$gt": datetime.utcnow()}},
+            {"_id": 0, "family_id": 1, "device_name": 1, "signed_in_at": 1, "created_at": 1, "expires_at": 1},
+        ).sort("created_at", -1).to_list(None)
@@ -0,0 +1,116 @@
+"""Production entry point: ``python -m backend.serve``.
+
+Runs ``server:app`` under uvicorn with one worker process per CPU, using
+uvloop and httptools when they are installed. Settings come from the
+environment:
+
+``WEB_CONCURRENCY``
+    Worker processes (default: the CPU count).
+``HOST`` / ``PORT``
+    Listening address (default ``0.0.0.0:8001``).
+``GRACEFUL_SHUTDOWN_SECONDS``
+    How long in-flight requests may finish after SIGTERM (default 30).
+``FORWARDED_ALLOW_IPS``
+    Proxies trusted for ``X-Forwarded-*`` headers (default ``127.0.0.1``).
+
+Migrations and index builds run once in a separate process before any worker
+starts, and ``STORAGE_PREPARED`` tells the workers to skip them. Each worker
+then opens its Mongo pool and warms its caches during startup, and uvicorn only hands it connections once that is done.
+``/api/health/ready`` reports whether a worker is ready.
+
+Process-local state is not shared between workers. With more than one
+worker, the response cache is therefore disabled unless
+``RESPONSE_CACHE_ENABLED`` is set explicitly, because an invalidation would
+only reach one worker.
+"""
+import asyncio
+import importlib.util
+import logging
+import multiprocessing
+import os
+import sys
+from pathlib import Path
+from typing import MutableMapping
+
+import uvicorn
+
+BACKEND_DIR = Path(__file__).resolve().parent
+
+logger = logging.getLogger("serve")
+
+
+def worker_count(env: MutableMapping[str, str] = os.environ) -> int:
+    return max(1, int(env.get('WEB_CONCURRENCY') or os.cpu_count() or 1))
+
+
+def event_loop() -> str:
+    return "uvloop" if importlib.util.find_spec("uvloop") else "asyncio"
+
+
+def http_protocol() -> str:
+    return "httptools" if importlib.util.find_spec("httptools") else "h11"
+
+
+def configure_workers(workers: int, env: MutableMapping[str, str] = os.environ):
+    """Adjust settings that are only correct within a single process"""
+    if workers <= 1:
+        return
+    if 'RESPONSE_CACHE_ENABLED' not in env:
+        env['RESPONSE_CACHE_ENABLED'] = 'false'
+        logger.info("Response cache disabled: its invalidation does not reach other workers")
+    if env.get('ADMISSION_BACKEND', 'memory') != 'mongo':
+        logger.warning("ADMISSION_BACKEND=memory enforces admission limits per worker, not per deployment")
+
+
+def _prepare_storage():
+    sys.path.insert(0, str(BACKEND_DIR))
+    import server
+
+    async def prepare():
+        try:
+            await server.prepare_storage()
+        finally:
+            server.client.close()
+
+    asyncio.run(prepare())
+
+
+def prepare_storage(env: MutableMapping[str, str] = os.environ):
+    """Run migrations and build indexes in a throwaway process.
+
+    Workers then find everything in place instead of racing each other, and
+    this process never binds a database client to an event loop.
+    """
+    process = multiprocessing.get_context("spawn").Process(target=_prepare_storage, name="prepare-storage")
+    process.start()
+    process.join()
+    if process.exitcode != 0:
+        raise SystemExit(f"Preparing the database failed (exit code {process.exitcode})")
+    # Inherited by the workers, whose startup then skips the migrations
+    env['STORAGE_PREPARED'] = 'true'
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    workers = worker_count()
+    configure_workers(workers)
+    prepare_storage()
+
+    loop, http = event_loop(), http_protocol()
+    logger.info("Starting %d worker(s) with %s and %s", workers, loop, http)
+    uvicorn.run(
+        "server:app",
+        app_dir=str(BACKEND_DIR),
+        host=os.environ.get('HOST', '0.0.0.0'),
+        port=int(os.environ.get('PORT', '8001')),
+        workers=workers,
+        loop=loop,
+        http=http,
+        timeout_graceful_shutdown=int(os.environ.get('GRACEFUL_SHUTDOWN_SECONDS', '30')),
+        proxy_headers=True,
+        forwarded_allow_ips=os.environ.get('FORWARDED_ALLOW_IPS', '127.0.0.1'),
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,26 +1,67 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, status
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, Header, Query, Request, Response, status
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from dotenv import load_dotenv
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError, PyMongoError
 from starlette.middleware.cors import CORSMiddleware
-from motor.motor_asyncio import AsyncIOMotorClient
 import os
+import asyncio
 import logging
+import time
 import bcrypt
 import jwt
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from pathlib import Path
-from pydantic import BaseModel, Field
-from typing import List, Optional
+from collections import defaultdict
+from pydantic import BaseModel, ConfigDict, Field, model_validator
+from typing import Annotated, Dict, List, Literal, Optional, Union
 import uuid
+import json
+import base64
+import hashlib
+import hmac
+import io
+import zipfile
+import zlib
 import urllib.parse
 
+from admission import (
+    AdmissionController,
+    AdmissionPolicy,
+    InMemoryAdmissionBackend,
+    MongoAdmissionBackend,
+    Rejected,
+)
+from archive import (
+    ARCHIVE_COLLECTIONS,
+    ROLLUP_COLLECTION,
+    archive_settled_sessions,
+    ensure_archive_indexes,
+)
+from batching import InsertBatcher
+from branches import branch_totals, merge_totals
+from cache import InMemoryCacheBackend, ResponseCache
+from database import create_client, read_database
+from invoice import InvoiceRenderer
+from jobs import JobQueue
+from profiling import ProfilingMiddleware
+from refresh_tokens import InvalidRefreshToken, RefreshTokenStore
+from snapshot import SnapshotError, Throughput, export_lines, gunzip_lines, gzip_stream, restore_lines
+from suggest import SuggestionStore
+
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
 # MongoDB connection
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+client = create_client(mongo_url)
 db = client[os.environ['DB_NAME']]
+# Read-heavy endpoints (dashboard, summaries, reports, exports) may be served by secondaries.
+# Responses that are cached are computed from the primary instead (see cacheable_db): the
+# cache is only cleared by writes, so a result missing a write would be served until the next one.
+read_db = read_database(client, os.environ['DB_NAME'])
 
 # Create the main app without a prefix
 app = FastAPI()
@@ -33,6 +74,91 @@ security = HTTPBearer()
 SECRET_KEY = os.environ.get('JWT_SECRET_KEY', 'your-secret-key-change-this')
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
+REFRESH_TOKEN_EXPIRE_DAYS = int(os.environ.get('REFRESH_TOKEN_EXPIRE_DAYS', '30'))
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN')
+
+# Request profiling (opt-in)
+PROFILE_DIR = os.environ.get('PROFILE_DIR', str(ROOT_DIR / 'profiles'))
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', '0'))
+PROFILE_INTERVAL_MS = float(os.environ.get('PROFILE_INTERVAL_MS', '5'))
+PROFILE_MAX_FILES = int(os.environ.get('PROFILE_MAX_FILES', '200'))
+
+# Delta sync
+SYNC_PAGE_SIZE = int(os.environ.get('SYNC_PAGE_SIZE', '500'))
+# Cursors are rewound by this much to pick up writes that committed late
+SYNC_OVERLAP_SECONDS = int(os.environ.get('SYNC_OVERLAP_SECONDS', '5'))
+TOMBSTONE_RETENTION_DAYS = int(os.environ.get('TOMBSTONE_RETENTION_DAYS', '30'))
+SYNC_COLLECTIONS = ["customers", "service_sessions", "services", "payments"]
+
+# Archive tier for settled service history
+ARCHIVE_AFTER_DAYS = int(os.environ.get('ARCHIVE_AFTER_DAYS', '180'))
+ARCHIVE_BATCH_SIZE = int(os.environ.get('ARCHIVE_BATCH_SIZE', '200'))
+ARCHIVE_INTERVAL_HOURS = float(os.environ.get('ARCHIVE_INTERVAL_HOURS', '0'))  # 0 disables the periodic run
+HOT_TIER = {collection: collection for collection in ARCHIVE_COLLECTIONS}
+ARCHIVE_TIER = ARCHIVE_COLLECTIONS
+SEARCH_SESSION_COLLECTIONS = {
+    "services": "service_sessions",
+    ARCHIVE_COLLECTIONS["services"]: ARCHIVE_COLLECTIONS["service_sessions"],
+}
+
+# Response cache for summaries and dashboards, invalidated by the write handlers
+RESPONSE_CACHE_ENABLED = os.environ.get('RESPONSE_CACHE_ENABLED', 'true').lower() == 'true'
+RESPONSE_CACHE_MAX_ENTRIES = int(os.environ.get('RESPONSE_CACHE_MAX_ENTRIES', '2000'))
+response_cache = ResponseCache(InMemoryCacheBackend(RESPONSE_CACHE_MAX_ENTRIES), enabled=RESPONSE_CACHE_ENABLED)
+
+def cacheable_db():
+    """The database cacheable responses are computed from: the primary while they are cached"""
+    return db if response_cache.enabled else read_db
+
+# Background jobs
+JOB_CONCURRENCY = int(os.environ.get('JOB_CONCURRENCY', '2'))
+JOB_MAX_ATTEMPTS = int(os.environ.get('JOB_MAX_ATTEMPTS', '3'))
+JOB_RETENTION_DAYS = int(os.environ.get('JOB_RETENTION_DAYS', '7'))
+job_queue = JobQueue(db.jobs, concurrency=JOB_CONCURRENCY, max_attempts=JOB_MAX_ATTEMPTS)
+
+# Refresh tokens, hashed with the JWT secret so verifying one needs no bcrypt
+refresh_tokens = RefreshTokenStore(db.refresh_tokens, SECRET_KEY, timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS))
+
+# Service description autocomplete
+SUGGEST_MAX_WORKSHOPS = int(os.environ.get('SUGGEST_MAX_WORKSHOPS', '200'))
+SUGGEST_MAX_AGE_SECONDS = float(os.environ.get('SUGGEST_MAX_AGE_SECONDS', '300'))
+SUGGEST_WARM_WORKSHOPS = int(os.environ.get('SUGGEST_WARM_WORKSHOPS', '20'))  # loaded at startup
+suggestions = SuggestionStore(db.service_suggestions, max_workshops=SUGGEST_MAX_WORKSHOPS, max_age=SUGGEST_MAX_AGE_SECONDS)
+
+# Coalesce concurrent inserts of services, payments and sessions into insert_many calls
+WRITE_BATCH_ENABLED = os.environ.get('WRITE_BATCH_ENABLED', 'false').lower() == 'true'
+WRITE_BATCH_WINDOW_MS = float(os.environ.get('WRITE_BATCH_WINDOW_MS', '2'))
+WRITE_BATCH_MAX_SIZE = int(os.environ.get('WRITE_BATCH_MAX_SIZE', '100'))
+write_batcher = InsertBatcher(
+    db, window=WRITE_BATCH_WINDOW_MS / 1000, max_batch=WRITE_BATCH_MAX_SIZE, enabled=WRITE_BATCH_ENABLED
+)
+
+# Workshop snapshots
+SNAPSHOT_CHUNK_SIZE = int(os.environ.get('SNAPSHOT_CHUNK_SIZE', '1000'))
+SNAPSHOT_RESTORE_CONCURRENCY = int(os.environ.get('SNAPSHOT_RESTORE_CONCURRENCY', '4'))
+
+# Streamed customer lists and dashboards are read and written this many customers at a time
+STREAM_BATCH_SIZE = int(os.environ.get('STREAM_BATCH_SIZE', '500'))
+
+# Branch workshops an owner may link for the consolidated dashboard
+MAX_BRANCHES = int(os.environ.get('MAX_BRANCHES', '20'))
+
+# Invoice PDFs, rendered in worker processes
+INVOICE_WORKERS = int(os.environ.get('INVOICE_WORKERS', str(min(2, os.cpu_count() or 1))))
+INVOICE_CACHE_MAX_ENTRIES = int(os.environ.get('INVOICE_CACHE_MAX_ENTRIES', '500'))
+MAX_INVOICE_BATCH = 100
+invoice_renderer = InvoiceRenderer(INVOICE_WORKERS, INVOICE_CACHE_MAX_ENTRIES)
+
+# Admission control for expensive endpoints, keyed by workshop
+ADMISSION_RATE_PER_SECOND = float(os.environ.get('ADMISSION_RATE_PER_SECOND', '2'))
+ADMISSION_BURST = int(os.environ.get('ADMISSION_BURST', '10'))
+ADMISSION_MAX_CONCURRENT = int(os.environ.get('ADMISSION_MAX_CONCURRENT', '4'))
+ADMISSION_BACKEND = os.environ.get('ADMISSION_BACKEND', 'memory')  # memory or mongo
+
+admission = AdmissionController(
+    MongoAdmissionBackend(db.admission) if ADMISSION_BACKEND == 'mongo' else InMemoryAdmissionBackend(),
+    AdmissionPolicy(ADMISSION_RATE_PER_SECOND, ADMISSION_BURST, ADMISSION_MAX_CONCURRENT),
+)
 
 # Models
 class UserCreate(BaseModel):
@@ -42,10 +168,15 @@ class UserCreate(BaseModel):
     workshop_name: Optional[str] = None
     workshop_id: Optional[str] = None
     role: str = "owner"  # owner or employee
+    device_name: Optional[str] = None
 
 class UserLogin(BaseModel):
     username: str
     password: str
+    device_name: Optional[str] = None
+
+class RefreshRequest(BaseModel):
+    refresh_token: str
 
 class User(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -67,9 +198,12 @@ class Customer(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     name: str
     phone: str
+    # Digits only with the 62 country code, see normalize_phone
+    phone_normalized: Optional[str] = None
     workshop_id: str
     total_debt: float = 0.0
     created_at: datetime = Field(default_factory=datetime.utcnow)
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
 
 class ServiceSessionCreate(BaseModel):
     session_name: str
@@ -81,6 +215,7 @@ class ServiceSession(BaseModel):
     session_date: datetime = Field(default_factory=datetime.utcnow)
     customer_id: str
     workshop_id: str
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
 
 class ServiceCreate(BaseModel):
     description: str
@@ -96,6 +231,12 @@ class Service(BaseModel):
     customer_id: str
     workshop_id: str
     created_at: datetime = Field(default_factory=datetime.utcnow)
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+
+class ServiceUpdate(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+    description: Optional[str] = None
+    price: Optional[float] = None
 
 class PaymentCreate(BaseModel):
     amount: float
@@ -111,6 +252,163 @@ class Payment(BaseModel):
     customer_id: str
     workshop_id: str
     payment_date: datetime = Field(default_factory=datetime.utcnow)
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+
+class PaymentUpdate(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+    amount: Optional[float] = None
+    description: Optional[str] = None
+
+MAX_BATCH_OPERATIONS = 500
+# Writes of one batch in flight at a time
+BATCH_WRITE_CONCURRENCY = 16
+
+class MutationOperation(BaseModel):
+    op: Literal["update", "delete"]
+    id: str
+
+    @model_validator(mode="after")
+    def require_changes(self):
+        if self.op == "update" and not (self.changes and self.changes.dict(exclude_none=True)):
+            raise ValueError("update operations need at least one change")
+        return self
+
+class ServiceOperation(MutationOperation):
+    target: Literal["service"]
+    changes: Optional[ServiceUpdate] = None
+
+class PaymentOperation(MutationOperation):
+    target: Literal["payment"]
+    changes: Optional[PaymentUpdate] = None
+
+class BatchMutationRequest(BaseModel):
+    operations: List[Annotated[Union[ServiceOperation, PaymentOperation], Field(discriminator="target")]] = Field(
+        min_length=1, max_length=MAX_BATCH_OPERATIONS
+    )
+
+class InvoiceBatchRequest(BaseModel):
+    session_ids: List[str] = Field(min_length=1, max_length=MAX_INVOICE_BATCH)
+
+class BranchLinkRequest(BaseModel):
+    # Credentials of the branch's owner account, proving access to its workshop
+    username: str
+    password: str
+
+class ArchiveRunRequest(BaseModel):
+    older_than_days: Optional[int] = Field(default=None, ge=1)
+
+MAX_WHATSAPP_BATCH = 200
+
+class WhatsAppBatchParams(BaseModel):
+    customer_ids: List[str] = Field(min_length=1, max_length=MAX_WHATSAPP_BATCH)
+
+# Job types clients may submit directly; the others are started by their own endpoints
+class ArchiveJobCreate(BaseModel):
+    type: Literal["archive"]
+    params: ArchiveRunRequest = Field(default_factory=ArchiveRunRequest)
+
+class WhatsAppBatchJobCreate(BaseModel):
+    type: Literal["whatsapp_batch"]
+    params: WhatsAppBatchParams
+
+JobCreate = Annotated[Union[ArchiveJobCreate, WhatsAppBatchJobCreate], Field(discriminator="type")]
+
+MAX_SUMMARY_BATCH = 200
+
+class CustomerSummariesRequest(BaseModel):
+    customer_ids: List[str] = Field(min_length=1, max_length=MAX_SUMMARY_BATCH)
+
+# Sparse fieldsets
+# Named views and `fields=` selections are turned into Mongo projections so
+# unrequested fields never leave the database. `None` means every field.
+CUSTOMER_VIEWS = {
+    "compact": ["id", "name", "phone", "total_debt"],
+}
+
+SUMMARY_GROUPS = {
+    "customer": Customer,
+    "session": ServiceSession,
+    "services": Service,
+    "payments": Payment,
+}
+
+SUMMARY_VIEWS = {
+    "compact": {
+        "customer": CUSTOMER_VIEWS["compact"],
+        "session": ["id", "session_name", "session_date"],
+        "services": [],
+        "payments": [],
+    },
+}
+
+def validate_fields(model, field_names: List[str]) -> List[str]:
+    unknown = [name for name in field_names if name not in model.model_fields]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    return ["id"] + [name for name in dict.fromkeys(field_names) if name != "id"]
+
+def resolve_view(views: dict, view: Optional[str]):
+    if view in (None, "full"):
+        return None
+    if view not in views:
+        raise HTTPException(status_code=400, detail=f"Unknown view: {view}")
+    return views[view]
+
+def resolve_customer_fields(fields: Optional[str], view: Optional[str]) -> Optional[List[str]]:
+    if fields:
+        return validate_fields(Customer, [name.strip() for name in fields.split(',') if name.strip()])
+    return resolve_view(CUSTOMER_VIEWS, view)
+
+def resolve_summary_fields(fields: Optional[str], view: Optional[str]) -> Dict[str, Optional[List[str]]]:
+    """Field selection per summary group.
+
+    Plain names select customer fields; `session.`, `services.` and
+    `payments.` prefixes select fields of the nested documents. Service and
+    payment lines are left out entirely unless one of their fields is asked for.
+    """
+    if not fields:
+        selected = resolve_view(SUMMARY_VIEWS, view)
+        return selected or {group: None for group in SUMMARY_GROUPS}
+
+    requested = {"customer": [], "session": [], "services": [], "payments": []}
+    for name in (name.strip() for name in fields.split(',')):
+        if not name:
+            continue
+        group, _, field = name.rpartition('.')
+        group = group or "customer"
+        if group not in requested:
+            raise HTTPException(status_code=400, detail=f"Unknown field group: {group}")
+        requested[group].append(field)
+
+    return {
+        group: validate_fields(SUMMARY_GROUPS[group], names) if names or group in ("customer", "session") else []
+        for group, names in requested.items()
+    }
+
+def mongo_projection(field_names: Optional[List[str]], *required: str) -> dict:
+    if field_names is None:
+        return {"_id": 0}
+    return {"_id": 0, **{name: 1 for name in [*field_names, *required]}}
+
+def pick_fields(model, document: dict, field_names: Optional[List[str]]) -> dict:
+    if field_names is None:
+        return model(**document).dict()
+    return {name: document[name] for name in field_names if name in document}
+
+# Streaming responses
+def ndjson_line(record: dict) -> bytes:
+    return json.dumps(record, default=datetime.isoformat).encode() + b"\n"
+
+async def cursor_chunks(cursor, chunk_size: int):
+    """Group the documents of a cursor into lists of up to `chunk_size`"""
+    chunk = []
+    async for document in cursor:
+        chunk.append(document)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
 
 # Token and Auth functions
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
@@ -123,6 +421,22 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
+def token_response(username: str, refresh_token: str) -> dict:
+    access_token = create_access_token(
+        data={"sub": username}, expires_delta=timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+    )
+    return {
+        "access_token": access_token,
+        "refresh_token": refresh_token,
+        "token_type": "bearer",
+        "expires_in": ACCESS_TOKEN_EXPIRE_MINUTES * 60,
+    }
+
+async def issue_tokens(user_id: str, username: str, device_name: Optional[str] = None) -> dict:
+    """Access token plus a refresh token starting a new device session"""
+    refresh_token, _ = await refresh_tokens.issue(user_id, device_name)
+    return token_response(username, refresh_token)
+
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
@@ -145,6 +459,68 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
     user_dict = {k: v for k, v in user.items() if k not in ['password', '_id']}
     return User(**user_dict)
 
+async def admit(workshop_id: str):
+    """Take an admission ticket for the workshop, or answer 429"""
+    try:
+        return await admission.acquire(workshop_id)
+    except Rejected as rejected:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=rejected.reason,
+            headers={"Retry-After": rejected.retry_after_header},
+        )
+
+def ticket_releaser(workshop_id: str, ticket):
+    """Release an admission ticket on the first call; later calls do nothing"""
+    released = False
+    
+    async def release():
+        nonlocal released
+        if not released:
+            released = True
+            await admission.release(workshop_id, ticket)
+    
+    return release
+
+async def get_admitted_user(current_user: User = Depends(get_current_user)):
+    """Authenticate and apply the workshop's rate limit and concurrency cap"""
+    ticket = await admit(current_user.workshop_id)
+    try:
+        yield current_user
+    finally:
+        await admission.release(current_user.workshop_id, ticket)
+
+async def require_admin(x_admin_token: Optional[str] = Header(None)):
+    """Operator endpoints, enabled only when ADMIN_TOKEN is configured"""
+    if not ADMIN_TOKEN or not x_admin_token or not hmac.compare_digest(x_admin_token, ADMIN_TOKEN):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admin token required")
+
+# Tombstones record deletions so offline clients can replay them through /sync
+async def write_tombstones(workshop_id: str, deleted_ids: Dict[str, List[str]]):
+    deleted_at = datetime.utcnow()
+    tombstones = [
+        {"id": document_id, "collection": collection, "workshop_id": workshop_id, "deleted_at": deleted_at}
+        for collection, ids in deleted_ids.items()
+        for document_id in ids
+    ]
+    if tombstones:
+        await db.tombstones.insert_many(tombstones)
+
+def normalize_phone(phone: str) -> str:
+    """Reduce a phone number to digits with the Indonesian country code"""
+    digits = "".join(character for character in phone if character.isdigit())
+    if digits.startswith('0'):
+        digits = '62' + digits[1:]
+    return digits
+
+async def adjust_customer_debt(workshop_id: str, customer_id: str, delta: float):
+    """Keep the customer's stored total_debt in step with its services and payments"""
+    if delta:
+        await db.customers.update_one(
+            {"id": customer_id, "workshop_id": workshop_id},
+            {"$inc": {"total_debt": delta}, "$set": {"updated_at": datetime.utcnow()}}
+        )
+
 # Auth Endpoints
 @api_router.post("/auth/register")
 async def register(user_data: UserCreate):
@@ -179,18 +555,14 @@ async def register(user_data: UserCreate):
     # Save to database
     await db.users.insert_one(user_db.dict())
     
-    # Create access token
-    access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    access_token = create_access_token(
-        data={"sub": user_db.username}, expires_delta=access_token_expires
-    )
+    tokens = await issue_tokens(user_db.id, user_db.username, user_data.device_name)
     
     # Create User object without password for response  
     user_response_dict = user_db.dict()
     user_response_dict.pop('password', None)
     user_response = User(**user_response_dict)
     
-    return {"access_token": access_token, "token_type": "bearer", "user": user_response.dict()}
+    return {**tokens, "user": user_response.dict()}
 
 @api_router.post("/auth/login")
 async def login(user_credentials: UserLogin):
@@ -202,17 +574,46 @@ async def login(user_credentials: UserLogin):
     if not bcrypt.checkpw(user_credentials.password.encode('utf-8'), user['password'].encode('utf-8')):
         raise HTTPException(status_code=401, detail="Invalid username or password")
     
-    # Create access token
-    access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    access_token = create_access_token(
-        data={"sub": user['username']}, expires_delta=access_token_expires
-    )
+    tokens = await issue_tokens(user['id'], user['username'], user_credentials.device_name)
     
     # Create User object without password for response
     user_response_dict = {k: v for k, v in user.items() if k not in ['password', '_id']}
     user_response = User(**user_response_dict)
     
-    return {"access_token": access_token, "token_type": "bearer", "user": user_response.dict()}
+    return {**tokens, "user": user_response.dict()}
+
+@api_router.post("/auth/refresh")
+async def refresh_access_token(request: RefreshRequest):
+    """Exchange a refresh token for a new access token and its rotated successor"""
+    try:
+        refresh_token, record = await refresh_tokens.rotate(request.refresh_token)
+    except InvalidRefreshToken as error:
+        raise HTTPException(status_code=401, detail=str(error))
+    
+    user = await db.users.find_one({"id": record['user_id']}, {"_id": 0, "username": 1})
+    if not user:
+        await refresh_tokens.revoke_family(record['user_id'], record['family_id'])
+        raise HTTPException(status_code=401, detail="User no longer exists")
+    return token_response(user['username'], refresh_token)
+
+@api_router.post("/auth/logout")
+async def logout(request: RefreshRequest):
+    """Sign out the device holding this refresh token"""
+    try:
+        await refresh_tokens.revoke(request.refresh_token)
+    except InvalidRefreshToken:
+        pass
+    return {"message": "Signed out"}
+
+@api_router.get("/auth/devices")
+async def get_devices(current_user: User = Depends(get_current_user)):
+    return await refresh_tokens.devices(current_user.id)
+
+@api_router.delete("/auth/devices/{family_id}")
+async def revoke_device(family_id: str, current_user: User = Depends(get_current_user)):
+    if not await refresh_tokens.revoke_family(current_user.id, family_id):
+        raise HTTPException(status_code=404, detail="Device not found")
+    return {"message": "Device signed out"}
 
 @api_router.get("/auth/me")
 async def get_me(current_user: User = Depends(get_current_user)):
@@ -223,84 +624,252 @@ async def get_me(current_user: User = Depends(get_current_user)):
 async def create_customer(customer_data: CustomerCreate, current_user: User = Depends(get_current_user)):
     customer_dict = customer_data.dict()
     customer_dict['workshop_id'] = current_user.workshop_id
+    customer_dict['phone_normalized'] = normalize_phone(customer_data.phone) or None
     customer_obj = Customer(**customer_dict)
     
-    await db.customers.insert_one(customer_obj.dict())
+    try:
+        await db.customers.insert_one(customer_obj.dict())
+    except DuplicateKeyError:
+        raise HTTPException(status_code=409, detail="A customer with this phone number already exists")
+    await response_cache.invalidate(current_user.workshop_id, "dashboard")
     return customer_obj
 
-@api_router.get("/customers", response_model=List[Customer])
-async def get_customers(current_user: User = Depends(get_current_user)):
-    customers = await db.customers.find({"workshop_id": current_user.workshop_id}).to_list(1000)
-    return [Customer(**customer) for customer in customers]
+@api_router.get("/customers")
+async def get_customers(
+    fields: Optional[str] = None,
+    view: Optional[str] = None,
+    current_user: User = Depends(get_current_user)
+):
+    field_names = resolve_customer_fields(fields, view)
+    customers = await db.customers.find(
+        {"workshop_id": current_user.workshop_id}, mongo_projection(field_names)
+    ).to_list(1000)
+    return [pick_fields(Customer, customer, field_names) for customer in customers]
 
-@api_router.delete("/customers/{customer_id}")
-async def delete_customer(customer_id: str, current_user: User = Depends(get_current_user)):
-    # Delete customer and all related data
-    await db.customers.delete_one({"id": customer_id, "workshop_id": current_user.workshop_id})
-    await db.service_sessions.delete_many({"customer_id": customer_id, "workshop_id": current_user.workshop_id})
-    await db.services.delete_many({"customer_id": customer_id, "workshop_id": current_user.workshop_id})
-    await db.payments.delete_many({"customer_id": customer_id, "workshop_id": current_user.workshop_id})
+@api_router.get("/customers/stream")
+async def stream_customers(
+    fields: Optional[str] = None,
+    view: Optional[str] = None,
+    current_user: User = Depends(get_current_user)
+):
+    """Every customer as NDJSON, written chunk by chunk as the cursor returns them"""
+    field_names = resolve_customer_fields(fields, view)
+    cursor = read_db.customers.find(
+        {"workshop_id": current_user.workshop_id}, mongo_projection(field_names), batch_size=STREAM_BATCH_SIZE
+    )
     
-    return {"message": "Customer and all related data deleted successfully"}
+    async def lines():
+        async for customers in cursor_chunks(cursor, STREAM_BATCH_SIZE):
+            yield b"".join(ndjson_line(pick_fields(Customer, customer, field_names)) for customer in customers)
+    
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
 
-@api_router.get("/customers/{customer_id}/summary")
-async def get_customer_summary(customer_id: str, current_user: User = Depends(get_current_user)):
-    # Get customer
-    customer = await db.customers.find_one({"id": customer_id, "workshop_id": current_user.workshop_id})
+@api_router.get("/customers/top-debtors")
+async def get_top_debtors(
+    limit: int = Query(10, ge=1, le=100),
+    min_debt: Optional[float] = None,
+    fields: Optional[str] = None,
+    view: Optional[str] = None,
+    current_user: User = Depends(get_current_user)
+):
+    # Served by the (workshop_id, total_debt) index, independent of the number of customers
+    field_names = resolve_customer_fields(fields, view)
+    debt_filter = {"$gte": min_debt} if min_debt is not None else {"$gt": 0}
+    customers = await read_db.customers.find(
+        {"workshop_id": current_user.workshop_id, "total_debt": debt_filter},
+        mongo_projection(field_names, "total_debt")
+    ).sort("total_debt", -1).limit(limit).to_list(limit)
+    return [pick_fields(Customer, customer, field_names) for customer in customers]
+
+@api_router.get("/customers/by-phone/{phone}")
+async def get_customer_by_phone(
+    phone: str,
+    fields: Optional[str] = None,
+    view: Optional[str] = None,
+    current_user: User = Depends(get_current_user)
+):
+    field_names = resolve_customer_fields(fields, view)
+    phone_normalized = normalize_phone(phone)
+    customer = await db.customers.find_one(
+        {"workshop_id": current_user.workshop_id, "phone_normalized": phone_normalized}, mongo_projection(field_names)
+    ) if phone_normalized else None
     if not customer:
         raise HTTPException(status_code=404, detail="Customer not found")
+    return pick_fields(Customer, customer, field_names)
+
+@api_router.delete("/customers/{customer_id}")
+async def delete_customer(customer_id: str, current_user: User = Depends(get_current_user)):
+    # Remove the customer right away; the cascade over related data runs as a background job
+    result = await db.customers.delete_one({"id": customer_id, "workshop_id": current_user.workshop_id})
+    if not result.deleted_count:
+        return {"message": "Customer deleted successfully", "job_id": None}
     
-    # Get service sessions
-    service_sessions = await db.service_sessions.find(
-        {"customer_id": customer_id, "workshop_id": current_user.workshop_id}
-    ).sort("session_date", -1).to_list(1000)
+    await write_tombstones(current_user.workshop_id, {"customers": [customer_id]})
+    await response_cache.invalidate(current_user.workshop_id, "dashboard", f"customer:{customer_id}")
+    job = await job_queue.submit(
+        "purge_customer_data", {"customer_id": customer_id}, current_user.workshop_id, current_user.username
+    )
     
-    service_sessions_summary = []
-    total_services_amount = 0
-    total_payments_amount = 0
+    return {"message": "Customer deleted successfully, related data is being removed", "job_id": job['id']}
+
+async def summarize_sessions(database, tier: Dict[str, str], customer_ids: List[str], workshop_id: str, selected: dict):
+    """Session summaries of several customers from the hot tier or the archive.
+
+    Uses three `$in` queries however many customers are requested. Returns
+    `{customer_id: [(session_date, summary), ...]}`.
+    """
+    service_sessions = await database[tier["service_sessions"]].find(
+        {"customer_id": {"$in": customer_ids}, "workshop_id": workshop_id},
+        mongo_projection(selected["session"], "session_date", "customer_id")
+    ).sort("session_date", -1).to_list(None)
+    session_ids = [session['id'] for session in service_sessions]
     
+    # Totals need prices and amounts even when the lines are not returned
+    services, payments = await asyncio.gather(
+        database[tier["services"]].find(
+            {"service_session_id": {"$in": session_ids}},
+            mongo_projection(selected["services"], "price", "service_session_id")
+        ).to_list(None),
+        database[tier["payments"]].find(
+            {"service_session_id": {"$in": session_ids}},
+            mongo_projection(selected["payments"], "amount", "service_session_id")
+        ).to_list(None)
+    )
+    services_by_session = defaultdict(list)
+    for service in services:
+        services_by_session[service['service_session_id']].append(service)
+    payments_by_session = defaultdict(list)
+    for payment in payments:
+        payments_by_session[payment['service_session_id']].append(payment)
+    
+    sessions_by_customer = defaultdict(list)
     for session in service_sessions:
-        # Get services for this session
-        services = await db.services.find({"service_session_id": session['id']}).to_list(1000)
-        session_services_total = sum(service['price'] for service in services)
-        
-        # Get payments for this session
-        payments = await db.payments.find({"service_session_id": session['id']}).to_list(1000)
-        session_payments_total = sum(payment['amount'] for payment in payments)
+        session_services = services_by_session[session['id']]
+        session_payments = payments_by_session[session['id']]
+        session_services_total = sum(service['price'] for service in session_services)
+        session_payments_total = sum(payment['amount'] for payment in session_payments)
         
         session_remaining_debt = session_services_total - session_payments_total
         
-        # Convert to model objects to avoid ObjectId serialization issues
-        session_obj = ServiceSession(**session)
-        service_objs = [Service(**service) for service in services]
-        payment_objs = [Payment(**payment) for payment in payments]
-        
-        service_sessions_summary.append({
-            "session": session_obj.dict(),
-            "services": [service.dict() for service in service_objs],
-            "payments": [payment.dict() for payment in payment_objs],
+        # Shape documents to the requested fields (model objects for full views)
+        session_summary = {"session": pick_fields(ServiceSession, session, selected["session"])}
+        if selected["services"] != []:
+            session_summary["services"] = [pick_fields(Service, service, selected["services"]) for service in session_services]
+        if selected["payments"] != []:
+            session_summary["payments"] = [pick_fields(Payment, payment, selected["payments"]) for payment in session_payments]
+        session_summary.update({
             "services_total": session_services_total,
             "payments_total": session_payments_total,
             "remaining_debt": session_remaining_debt
         })
-        
-        total_services_amount += session_services_total
-        total_payments_amount += session_payments_total
+        sessions_by_customer[session['customer_id']].append((session['session_date'], session_summary))
+    
+    return sessions_by_customer
+
+async def build_customer_summaries(
+    database,
+    customer_ids: List[str],
+    workshop_id: str,
+    fields: Optional[str],
+    view: Optional[str],
+    include_archive: bool
+) -> Dict[str, dict]:
+    """Summaries keyed by customer id; customers that do not exist are left out"""
+    selected = resolve_summary_fields(fields, view)
     
-    # Calculate remaining debt
-    remaining_debt = total_services_amount - total_payments_amount
+    customers = await database.customers.find(
+        {"id": {"$in": customer_ids}, "workshop_id": workshop_id},
+        mongo_projection(selected["customer"])
+    ).to_list(None)
+    found_ids = [customer['id'] for customer in customers]
+    if not found_ids:
+        return {}
     
-    # Convert customer to model object
-    customer_obj = Customer(**customer)
+    tiers = [HOT_TIER, ARCHIVE_TIER] if include_archive else [HOT_TIER]
+    sessions_by_tier = await asyncio.gather(
+        *[summarize_sessions(database, tier, found_ids, workshop_id, selected) for tier in tiers]
+    )
+    rollups = {
+        rollup['customer_id']: rollup
+        for rollup in await database[ROLLUP_COLLECTION].find(
+            {"customer_id": {"$in": found_ids}, "workshop_id": workshop_id}, {"_id": 0}
+        ).to_list(None)
+    }
     
+    summaries = {}
+    for customer in customers:
+        sessions = [dated for tier_sessions in sessions_by_tier for dated in tier_sessions.get(customer['id'], [])]
+        sessions.sort(key=lambda dated: dated[0], reverse=True)
+        service_sessions_summary = [summary for _, summary in sessions]
+        
+        total_services_amount = sum(summary['services_total'] for summary in service_sessions_summary)
+        total_payments_amount = sum(summary['payments_total'] for summary in service_sessions_summary)
+        
+        # Archived sessions are only summarized by the rollup unless explicitly included
+        rollup = rollups.get(customer['id'], {})
+        if not include_archive:
+            total_services_amount += rollup.get('services_total', 0)
+            total_payments_amount += rollup.get('payments_total', 0)
+        
+        # Calculate remaining debt
+        remaining_debt = total_services_amount - total_payments_amount
+        
+        summaries[customer['id']] = {
+            "customer": pick_fields(Customer, customer, selected["customer"]),
+            "service_sessions": service_sessions_summary,
+            "total_services_amount": total_services_amount,
+            "total_payments_amount": total_payments_amount,
+            "remaining_debt": remaining_debt,
+            "archived_service_sessions": rollup.get('service_sessions', 0)
+        }
+    return summaries
+
+@api_router.post("/customers/summaries")
+async def get_customer_summaries(
+    request: CustomerSummariesRequest,
+    fields: Optional[str] = None,
+    view: Optional[str] = None,
+    include_archive: bool = False,
+    current_user: User = Depends(get_admitted_user)
+):
+    customer_ids = list(dict.fromkeys(request.customer_ids))
+    summaries = await build_customer_summaries(
+        read_db, customer_ids, current_user.workshop_id, fields, view, include_archive
+    )
     return {
-        "customer": customer_obj.dict(),
-        "service_sessions": service_sessions_summary,
-        "total_services_amount": total_services_amount,
-        "total_payments_amount": total_payments_amount,
-        "remaining_debt": remaining_debt
+        "summaries": [summaries[customer_id] for customer_id in customer_ids if customer_id in summaries],
+        "not_found": [customer_id for customer_id in customer_ids if customer_id not in summaries]
     }
 
+@api_router.get("/customers/{customer_id}/summary")
+async def get_customer_summary(
+    customer_id: str,
+    fields: Optional[str] = None,
+    view: Optional[str] = None,
+    include_archive: bool = False,
+    current_user: User = Depends(get_admitted_user)
+):
+    return await response_cache.get_or_compute(
+        current_user.workshop_id,
+        "customer_summary",
+        {"customer_id": customer_id, "fields": fields, "view": view, "include_archive": include_archive},
+        ["summary", f"customer:{customer_id}"],
+        lambda: build_customer_summary(cacheable_db(), customer_id, current_user.workshop_id, fields, view, include_archive)
+    )
+
+async def build_customer_summary(
+    database,
+    customer_id: str,
+    workshop_id: str,
+    fields: Optional[str],
+    view: Optional[str],
+    include_archive: bool
+):
+    summaries = await build_customer_summaries(database, [customer_id], workshop_id, fields, view, include_archive)
+    if customer_id not in summaries:
+        raise HTTPException(status_code=404, detail="Customer not found")
+    return summaries[customer_id]
+
 # Service Session Endpoints
 @api_router.post("/service-sessions", response_model=ServiceSession)
 async def create_service_session(session_data: ServiceSessionCreate, current_user: User = Depends(get_current_user)):
@@ -308,7 +877,8 @@ async def create_service_session(session_data: ServiceSessionCreate, current_use
     session_dict['workshop_id'] = current_user.workshop_id
     session_obj = ServiceSession(**session_dict)
     
-    await db.service_sessions.insert_one(session_obj.dict())
+    await write_batcher.insert("service_sessions", session_obj.dict())
+    await response_cache.invalidate(current_user.workshop_id, "dashboard", f"customer:{session_obj.customer_id}")
     return session_obj
 
 @api_router.get("/customers/{customer_id}/service-sessions")
@@ -325,22 +895,124 @@ async def create_service(service_data: ServiceCreate, current_user: User = Depen
     service_dict['workshop_id'] = current_user.workshop_id
     service_obj = Service(**service_dict)
     
-    await db.services.insert_one(service_obj.dict())
+    await write_batcher.insert("services", service_obj.dict())
+    await adjust_customer_debt(current_user.workshop_id, service_obj.customer_id, service_obj.price)
+    await suggestions.record(current_user.workshop_id, service_obj.description, service_obj.price)
+    await response_cache.invalidate(current_user.workshop_id, "dashboard", f"customer:{service_obj.customer_id}")
     return service_obj
 
 @api_router.put("/services/{service_id}")
-async def update_service(service_id: str, service_data: dict, current_user: User = Depends(get_current_user)):
-    await db.services.update_one(
+async def update_service(service_id: str, service_data: ServiceUpdate, current_user: User = Depends(get_current_user)):
+    changes = service_data.dict(exclude_none=True)
+    service = await db.services.find_one_and_update(
         {"id": service_id, "workshop_id": current_user.workshop_id},
-        {"$set": service_data}
+        {"$set": {**changes, "updated_at": datetime.utcnow()}},
+        projection={"_id": 0, "customer_id": 1, "description": 1, "price": 1}
     )
+    if service:
+        if 'price' in changes:
+            await adjust_customer_debt(current_user.workshop_id, service['customer_id'], changes['price'] - service['price'])
+        if changes:
+            await suggestions.record_many(current_user.workshop_id, [
+                (service['description'], service['price'], -1),
+                (changes.get('description', service['description']), changes.get('price', service['price']), 1),
+            ])
+        await response_cache.invalidate(current_user.workshop_id, "dashboard", f"customer:{service['customer_id']}")
     return {"message": "Service updated successfully"}
 
 @api_router.delete("/services/{service_id}")
 async def delete_service(service_id: str, current_user: User = Depends(get_current_user)):
-    await db.services.delete_one({"id": service_id, "workshop_id": current_user.workshop_id})
+    service = await db.services.find_one_and_delete(
+        {"id": service_id, "workshop_id": current_user.workshop_id},
+        projection={"_id": 0, "customer_id": 1, "description": 1, "price": 1}
+    )
+    if service:
+        await adjust_customer_debt(current_user.workshop_id, service['customer_id'], -service['price'])
+        await suggestions.record(current_user.workshop_id, service['description'], service['price'], -1)
+        await write_tombstones(current_user.workshop_id, {"services": [service_id]})
+        await response_cache.invalidate(current_user.workshop_id, "dashboard", f"customer:{service['customer_id']}")
     return {"message": "Service deleted successfully"}
 
+@api_router.get("/services/suggest")
+async def suggest_services(
+    prefix: str = Query(..., min_length=1, max_length=100),
+    limit: int = Query(10, ge=1, le=50),
+    current_user: User = Depends(get_current_user)
+):
+    """Autocomplete service descriptions with their typical price, most used first"""
+    return await suggestions.suggest(current_user.workshop_id, prefix, limit)
+
+def encode_search_cursor(result: dict) -> str:
+    position = [result['score'], result['created_at'].isoformat(), result['id']]
+    return base64.urlsafe_b64encode(json.dumps(position).encode()).decode()
+
+def decode_search_cursor(cursor: str):
+    try:
+        score, created_at, service_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return float(score), datetime.fromisoformat(created_at), str(service_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid search cursor")
+
+async def search_tier(collection: str, match: dict, position, limit: int):
+    pipeline = [
+        {"$match": match},
+        {"$addFields": {"score": {"$meta": "textScore"}}},
+    ]
+    if position:
+        score, created_at, service_id = position
+        pipeline.append({"$match": {"$or": [
+            {"score": {"$lt": score}},
+            {"score": score, "created_at": {"$lt": created_at}},
+            {"score": score, "created_at": created_at, "id": {"$lt": service_id}},
+        ]}})
+    pipeline += [
+        {"$sort": {"score": -1, "created_at": -1, "id": -1}},
+        {"$limit": limit},
+        {"$lookup": {"from": "customers", "localField": "customer_id", "foreignField": "id", "as": "customer"}},
+        {"$lookup": {"from": SEARCH_SESSION_COLLECTIONS[collection], "localField": "service_session_id", "foreignField": "id", "as": "session"}},
+        {"$project": {
+            "_id": 0,
+            "id": 1, "description": 1, "price": 1, "service_session_id": 1, "customer_id": 1, "created_at": 1, "score": 1,
+            "customer": {"$arrayElemAt": [{"$map": {"input": "$customer", "in": {"id": "$$this.id", "name": "$$this.name", "phone": "$$this.phone"}}}, 0]},
+            "session": {"$arrayElemAt": [{"$map": {"input": "$session", "in": {"id": "$$this.id", "session_name": "$$this.session_name", "session_date": "$$this.session_date"}}}, 0]},
+        }},
+    ]
+    return await read_db[collection].aggregate(pipeline).to_list(limit)
+
+@api_router.get("/services/search")
+async def search_services(
+    q: str = Query(..., min_length=1),
+    date_from: Optional[datetime] = Query(None, alias="from"),
+    date_to: Optional[datetime] = Query(None, alias="to"),
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = None,
+    include_archive: bool = False,
+    current_user: User = Depends(get_admitted_user)
+):
+    """Services whose description matches `q`, best matches and newest first.
+
+    Pass `next_cursor` back as `cursor` to fetch the following page.
+    """
+    match = {"$text": {"$search": q}, "workshop_id": current_user.workshop_id}
+    if date_from or date_to:
+        match["created_at"] = {}
+        if date_from:
+            match["created_at"]["$gte"] = date_from
+        if date_to:
+            match["created_at"]["$lte"] = date_to
+    position = decode_search_cursor(cursor) if cursor else None
+    
+    collections = ["services", ARCHIVE_COLLECTIONS["services"]] if include_archive else ["services"]
+    tiers = await asyncio.gather(*[search_tier(collection, match, position, limit + 1) for collection in collections])
+    results = sorted(
+        (result for tier in tiers for result in tier),
+        key=lambda result: (result['score'], result['created_at'], result['id']),
+        reverse=True
+    )
+    
+    next_cursor = encode_search_cursor(results[limit - 1]) if len(results) > limit else None
+    return {"results": results[:limit], "next_cursor": next_cursor}
+
 # Payment Endpoints
 @api_router.post("/payments", response_model=Payment)
 async def create_payment(payment_data: PaymentCreate, current_user: User = Depends(get_current_user)):
@@ -348,39 +1020,398 @@ async def create_payment(payment_data: PaymentCreate, current_user: User = Depen
     payment_dict['workshop_id'] = current_user.workshop_id
     payment_obj = Payment(**payment_dict)
     
-    await db.payments.insert_one(payment_obj.dict())
+    await write_batcher.insert("payments", payment_obj.dict())
+    await adjust_customer_debt(current_user.workshop_id, payment_obj.customer_id, -payment_obj.amount)
+    await response_cache.invalidate(current_user.workshop_id, "dashboard", f"customer:{payment_obj.customer_id}")
     return payment_obj
 
+# Batch Mutations
+# target -> (collection, amount field, sign of the amount in the customer's debt)
+BATCH_TARGETS = {
+    "service": ("services", "price", 1),
+    "payment": ("payments", "amount", -1),
+}
+
+@api_router.post("/batch")
+async def apply_batch_mutations(batch: BatchMutationRequest, current_user: User = Depends(get_current_user)):
+    """Apply many service and payment updates and deletes in one request"""
+    workshop_id = current_user.workshop_id
+    operations = batch.operations
+    
+    # Concurrent writes give no guarantee which of two operations on one document wins
+    targets = [(operation.target, operation.id) for operation in operations]
+    if len(set(targets)) != len(targets):
+        raise HTTPException(status_code=400, detail="Each document may appear only once per batch")
+    
+    # Current versions supply the old amounts and descriptions for debt and suggestion bookkeeping
+    current = {}
+    for target, (collection, amount_field, _) in BATCH_TARGETS.items():
+        ids = [operation.id for operation in operations if operation.target == target]
+        documents = await db[collection].find(
+            {"workshop_id": workshop_id, "id": {"$in": ids}},
+            {"_id": 0, "id": 1, "customer_id": 1, "description": 1, "updated_at": 1, amount_field: 1}
+        ).to_list(None) if ids else []
+        current[target] = {document['id']: document for document in documents}
+    
+    now = datetime.utcnow()
+    semaphore = asyncio.Semaphore(BATCH_WRITE_CONCURRENCY)
+    
+    async def apply(operation) -> tuple:
+        """Write one operation, returning its status and error"""
+        document = current[operation.target].get(operation.id)
+        if document is None:
+            return "not_found", None
+        collection = db[BATCH_TARGETS[operation.target][0]]
+        # Only matches the version read above, so the bookkeeping below uses the true old values
+        version_filter = {"id": operation.id, "workshop_id": workshop_id, "updated_at": document.get('updated_at')}
+        async with semaphore:
+            try:
+                if operation.op == "delete":
+                    matched = await collection.find_one_and_delete(version_filter, projection={"_id": 1})
+                else:
+                    changes = operation.changes.dict(exclude_none=True)
+                    matched = await collection.find_one_and_update(
+                        version_filter, {"$set": {**changes, "updated_at": now}}, projection={"_id": 1}
+                    )
+            except PyMongoError as error:
+                # Includes network errors that outlast the driver's write retry, so one
+                # failed operation never skips the bookkeeping of those that matched
+                return "failed", str(error)
+        if matched is None:
+            return "conflict", None
+        return ("deleted" if operation.op == "delete" else "updated"), None
+    
+    outcomes = await asyncio.gather(*[apply(operation) for operation in operations])
+    
+    results = []
+    debt_deltas = defaultdict(float)
+    suggestion_uses = []
+    deleted_ids = defaultdict(list)
+    for index, (operation, (outcome, error)) in enumerate(zip(operations, outcomes)):
+        results.append({"index": index, "target": operation.target, "op": operation.op, "id": operation.id, "status": outcome})
+        if error:
+            results[index]['error'] = error
+        if outcome not in ("updated", "deleted"):
+            continue
+        
+        collection, amount_field, sign = BATCH_TARGETS[operation.target]
+        document = current[operation.target][operation.id]
+        old_amount = document[amount_field]
+        if operation.op == "delete":
+            new_amount = 0
+            deleted_ids[collection].append(operation.id)
+        else:
+            changes = operation.changes.dict(exclude_none=True)
+            new_amount = changes.get(amount_field, old_amount)
+        debt_deltas[document['customer_id']] += sign * (new_amount - old_amount)
+        
+        if operation.target == "service":
+            suggestion_uses.append((document['description'], old_amount, -1))
+            if operation.op == "update":
+                suggestion_uses.append((changes.get('description', document['description']), new_amount, 1))
+    
+    for customer_id, delta in debt_deltas.items():
+        await adjust_customer_debt(workshop_id, customer_id, delta)
+    await suggestions.record_many(workshop_id, suggestion_uses)
+    await write_tombstones(workshop_id, deleted_ids)
+    if debt_deltas:
+        await response_cache.invalidate(
+            workshop_id, "dashboard", *[f"customer:{customer_id}" for customer_id in debt_deltas]
+        )
+    
+    return {
+        "results": results,
+        "applied": sum(1 for result in results if result['status'] in ("updated", "deleted")),
+    }
+
 # Dashboard Endpoint
 @api_router.get("/dashboard")
-async def get_dashboard(current_user: User = Depends(get_current_user)):
+async def get_dashboard(
+    fields: Optional[str] = None,
+    view: Optional[str] = None,
+    current_user: User = Depends(get_admitted_user)
+):
+    return await response_cache.get_or_compute(
+        current_user.workshop_id,
+        "dashboard",
+        {"fields": fields, "view": view},
+        ["dashboard"],
+        lambda: build_dashboard(cacheable_db(), current_user.workshop_id, fields, view)
+    )
+
+async def build_dashboard(database, workshop_id: str, fields: Optional[str], view: Optional[str]):
+    field_names = resolve_customer_fields(fields, view)
+    
     # Get all customers
-    customers = await db.customers.find({"workshop_id": current_user.workshop_id}).to_list(1000)
+    customers = await database.customers.find(
+        {"workshop_id": workshop_id}, mongo_projection(field_names)
+    ).to_list(1000)
     
-    customers_summary = []
+    return {"customers": await dashboard_entries(database, customers, workshop_id, field_names)}
+
+@api_router.get("/dashboard/stream")
+async def stream_dashboard(
+    fields: Optional[str] = None,
+    view: Optional[str] = None,
+    current_user: User = Depends(get_current_user)
+):
+    """The dashboard entries as NDJSON, computed and written one chunk of customers at a time"""
+    workshop_id = current_user.workshop_id
+    field_names = resolve_customer_fields(fields, view)
+    # Dependencies exit before a streamed body is sent, so the response holds the
+    # ticket. The body releases it after the last chunk; the background task
+    # covers a body that never started because the client went away first
+    release = ticket_releaser(workshop_id, await admit(workshop_id))
+    cursor = read_db.customers.find(
+        {"workshop_id": workshop_id}, mongo_projection(field_names), batch_size=STREAM_BATCH_SIZE
+    )
+    
+    async def lines():
+        try:
+            async for customers in cursor_chunks(cursor, STREAM_BATCH_SIZE):
+                entries = await dashboard_entries(read_db, customers, workshop_id, field_names)
+                yield b"".join(ndjson_line(entry) for entry in entries)
+        finally:
+            await release()
+    
+    return StreamingResponse(lines(), media_type="application/x-ndjson", background=BackgroundTask(release))
+
+async def sum_by_customer(database, collection: str, workshop_id: str, customer_ids: List[str], amount_field: Optional[str] = None):
+    """`{customer_id: (count, total of amount_field)}` for the given customers in one query"""
+    group = {"_id": "$customer_id", "count": {"$sum": 1}}
+    if amount_field:
+        group["total"] = {"$sum": f"${amount_field}"}
+    results = await database[collection].aggregate([
+        {"$match": {"workshop_id": workshop_id, "customer_id": {"$in": customer_ids}}},
+        {"$group": group},
+    ]).to_list(None)
+    return {result['_id']: (result['count'], result.get('total', 0)) for result in results}
+
+async def dashboard_entries(database, customers: List[dict], workshop_id: str, field_names: Optional[List[str]]) -> List[dict]:
+    """Dashboard entries of several customers, with one query per collection for all of them"""
+    customer_ids = [customer['id'] for customer in customers]
+    services, payments, service_sessions, rollup_list = await asyncio.gather(
+        sum_by_customer(database, "services", workshop_id, customer_ids, "price"),
+        sum_by_customer(database, "payments", workshop_id, customer_ids, "amount"),
+        sum_by_customer(database, "service_sessions", workshop_id, customer_ids),
+        # Archived history is counted through the per-customer rollups
+        database[ROLLUP_COLLECTION].find(
+            {"workshop_id": workshop_id, "customer_id": {"$in": customer_ids}}, {"_id": 0}
+        ).to_list(None)
+    )
+    rollups = {rollup['customer_id']: rollup for rollup in rollup_list}
     
+    entries = []
     for customer in customers:
-        # Get customer stats
-        services = await db.services.find({"customer_id": customer['id']}).to_list(1000)
-        payments = await db.payments.find({"customer_id": customer['id']}).to_list(1000)
-        service_sessions = await db.service_sessions.find({"customer_id": customer['id']}).to_list(1000)
+        rollup = rollups.get(customer['id'], {})
+        services_count, services_amount = services.get(customer['id'], (0, 0))
+        payments_count, payments_amount = payments.get(customer['id'], (0, 0))
+        sessions_count, _ = service_sessions.get(customer['id'], (0, 0))
         
-        total_services_amount = sum(service['price'] for service in services)
-        total_payments_amount = sum(payment['amount'] for payment in payments)
+        total_services_amount = services_amount + rollup.get('services_total', 0)
+        total_payments_amount = payments_amount + rollup.get('payments_total', 0)
         total_debt = total_services_amount - total_payments_amount
         
-        # Convert customer to model object
-        customer_obj = Customer(**customer)
-        
-        customers_summary.append({
-            "customer": customer_obj.dict(),
+        entries.append({
+            "customer": pick_fields(Customer, customer, field_names),
             "total_debt": total_debt,
-            "total_services": len(services),
-            "total_payments": len(payments),
-            "total_service_sessions": len(service_sessions)
+            "total_services": services_count + rollup.get('services', 0),
+            "total_payments": payments_count + rollup.get('payments', 0),
+            "total_service_sessions": sessions_count + rollup.get('service_sessions', 0)
         })
+    return entries
+
+# Owner Branches
+@api_router.post("/owner/branches")
+async def link_branch(request: BranchLinkRequest, current_user: User = Depends(get_current_user)):
+    """Link the workshop of another owner account, given its credentials"""
+    if current_user.role != "owner":
+        raise HTTPException(status_code=403, detail="Only owners can link branches")
+    
+    branch_owner = await db.users.find_one({"username": request.username})
+    if not branch_owner or not bcrypt.checkpw(request.password.encode('utf-8'), branch_owner['password'].encode('utf-8')):
+        raise HTTPException(status_code=401, detail="Invalid username or password")
+    if branch_owner.get('role') != "owner":
+        raise HTTPException(status_code=400, detail="Only an owner account can link its workshop")
+    if branch_owner['workshop_id'] == current_user.workshop_id:
+        raise HTTPException(status_code=400, detail="This is your own workshop")
+    if await db.workshop_links.count_documents({"owner_id": current_user.id}) >= MAX_BRANCHES:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BRANCHES} branches can be linked")
+    
+    link = {
+        "owner_id": current_user.id,
+        "workshop_id": branch_owner['workshop_id'],
+        "workshop_name": branch_owner.get('workshop_name'),
+        "linked_at": datetime.utcnow(),
+    }
+    # Linking a branch again keeps the original link
+    return await db.workshop_links.find_one_and_update(
+        {"owner_id": current_user.id, "workshop_id": link['workshop_id']},
+        {"$setOnInsert": link},
+        projection={"_id": 0, "workshop_id": 1, "workshop_name": 1, "linked_at": 1},
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+    )
+
+@api_router.get("/owner/branches")
+async def get_branches(current_user: User = Depends(get_current_user)):
+    return await db.workshop_links.find(
+        {"owner_id": current_user.id}, {"_id": 0, "owner_id": 0}
+    ).sort("linked_at", 1).to_list(MAX_BRANCHES)
+
+@api_router.delete("/owner/branches/{workshop_id}")
+async def unlink_branch(workshop_id: str, current_user: User = Depends(get_current_user)):
+    result = await db.workshop_links.delete_one({"owner_id": current_user.id, "workshop_id": workshop_id})
+    if result.deleted_count == 0:
+        raise HTTPException(status_code=404, detail="Branch not found")
+    return {"message": "Branch unlinked"}
+
+@api_router.get("/owner/linked-by")
+async def get_linking_owners(current_user: User = Depends(get_current_user)):
+    """Owners who linked this workshop as one of their branches"""
+    if current_user.role != "owner":
+        raise HTTPException(status_code=403, detail="Only owners can see who linked the workshop")
+    
+    links = await db.workshop_links.find(
+        {"workshop_id": current_user.workshop_id}, {"_id": 0, "owner_id": 1, "linked_at": 1}
+    ).sort("linked_at", 1).to_list(None)
+    owners = await db.users.find(
+        {"id": {"$in": [link['owner_id'] for link in links]}}, {"_id": 0, "id": 1, "username": 1, "workshop_name": 1}
+    ).to_list(None)
+    owners_by_id = {owner['id']: owner for owner in owners}
+    return [
+        {
+            **link,
+            "username": owners_by_id.get(link['owner_id'], {}).get('username'),
+            "workshop_name": owners_by_id.get(link['owner_id'], {}).get('workshop_name'),
+        }
+        for link in links
+    ]
+
+@api_router.delete("/owner/linked-by/{owner_id}")
+async def revoke_branch_link(owner_id: str, current_user: User = Depends(get_current_user)):
+    """Stop another owner from seeing this workshop on their dashboard"""
+    if current_user.role != "owner":
+        raise HTTPException(status_code=403, detail="Only owners can revoke a branch link")
+    
+    result = await db.workshop_links.delete_one({"owner_id": owner_id, "workshop_id": current_user.workshop_id})
+    if result.deleted_count == 0:
+        raise HTTPException(status_code=404, detail="Link not found")
+    return {"message": "Branch link revoked"}
+
+@api_router.get("/owner/dashboard")
+async def get_owner_dashboard(current_user: User = Depends(get_admitted_user)):
+    """Customer counts, debt and revenue of the own workshop and every linked branch"""
+    links = await db.workshop_links.find(
+        {"owner_id": current_user.id}, {"_id": 0, "workshop_id": 1, "workshop_name": 1}
+    ).sort("linked_at", 1).to_list(MAX_BRANCHES)
+    branches = [{"workshop_id": current_user.workshop_id, "workshop_name": current_user.workshop_name}, *links]
+    
+    # Cached per branch under the branch's own workshop, so its writes invalidate it
+    totals = await asyncio.gather(*[
+        response_cache.get_or_compute(
+            branch['workshop_id'],
+            "branch_totals",
+            {},
+            ["dashboard"],
+            lambda workshop_id=branch['workshop_id']: branch_totals(cacheable_db(), workshop_id)
+        )
+        for branch in branches
+    ])
+    return {
+        "branches": [{**branch, **branch_total} for branch, branch_total in zip(branches, totals)],
+        "totals": merge_totals(totals),
+    }
+
+# Archive Endpoint
+@api_router.post("/archive/run", status_code=status.HTTP_202_ACCEPTED)
+async def run_archive(request: ArchiveRunRequest, current_user: User = Depends(get_current_user)):
+    if current_user.role != "owner":
+        raise HTTPException(status_code=403, detail="Only workshop owners can archive history")
+    
+    return await job_queue.submit(
+        "archive", {"older_than_days": request.older_than_days}, current_user.workshop_id, current_user.username
+    )
+
+# Delta Sync Endpoint
+@api_router.get("/sync")
+async def sync_changes(
+    since: Optional[str] = None,
+    limit: int = SYNC_PAGE_SIZE,
+    current_user: User = Depends(get_admitted_user)
+):
+    """Documents changed or deleted since `since`.
+
+    Pass the returned `cursor` as `since` on the next call and keep calling
+    while `has_more` is true. Pages can overlap, so clients upsert by id.
+    A cursor is an `updated_at` timestamp, followed by `,<id>` when a page
+    stopped within documents sharing that timestamp.
+    When `reset` is true the cursor was older than the tombstone retention
+    and the client must replace its local data with this (full) result.
+    """
+    started_at = datetime.utcnow()
+    limit = max(1, min(limit, SYNC_PAGE_SIZE))
     
-    return {"customers": customers_summary}
+    since_dt = None
+    since_id = ""
+    reset = since is None
+    if since:
+        since, _, since_id = since.partition(",")
+        try:
+            since_dt = datetime.fromisoformat(since)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid sync cursor")
+        # Stored timestamps are naive UTC; accept cursors written with an offset such as `Z`
+        if since_dt.tzinfo is not None:
+            since_dt = since_dt.astimezone(timezone.utc).replace(tzinfo=None)
+        if since_dt < started_at - timedelta(days=TOMBSTONE_RETENTION_DAYS):
+            since_dt = None
+            reset = True
+    
+    # Read from the primary: a lagging secondary could skip writes behind the cursor
+    changes = {}
+    truncated_at = []
+    for collection in SYNC_COLLECTIONS:
+        query = {"workshop_id": current_user.workshop_id}
+        # Keyset on (updated_at, id), so a page ending within documents that
+        # share one timestamp continues after the last one instead of repeating
+        if since_dt and since_id:
+            query["$or"] = [
+                {"updated_at": {"$gt": since_dt}},
+                {"updated_at": since_dt, "id": {"$gt": since_id}},
+            ]
+        elif since_dt:
+            query["updated_at"] = {"$gte": since_dt}
+        documents = await db[collection].find(query, {"_id": 0}).sort(
+            [("updated_at", 1), ("id", 1)]
+        ).to_list(limit + 1)
+        if len(documents) > limit:
+            documents = documents[:limit]
+            truncated_at.append((documents[-1]['updated_at'], documents[-1]['id']))
+        changes[collection] = documents
+    
+    deleted = {collection: [] for collection in SYNC_COLLECTIONS}
+    if since_dt:
+        tombstones = await db.tombstones.find(
+            {"workshop_id": current_user.workshop_id, "deleted_at": {"$gte": since_dt}},
+            {"_id": 0, "id": 1, "collection": 1}
+        ).to_list(None)
+        for tombstone in tombstones:
+            deleted[tombstone['collection']].append(tombstone['id'])
+    
+    if truncated_at:
+        cursor_dt, cursor_id = min(truncated_at)
+        cursor = f"{cursor_dt.isoformat()},{cursor_id}"
+    else:
+        cursor = (started_at - timedelta(seconds=SYNC_OVERLAP_SECONDS)).isoformat()
+    
+    return {
+        **changes,
+        "deleted": deleted,
+        "cursor": cursor,
+        "has_more": bool(truncated_at),
+        "reset": reset
+    }
 
 # Helper function for datetime formatting
 def format_datetime(dt_obj, format_str):
@@ -397,10 +1428,13 @@ def format_datetime(dt_obj, format_str):
 async def generate_whatsapp_message(
     customer_id: str, 
     session_id: Optional[str] = None,
-    current_user: User = Depends(get_current_user)
+    include_archive: bool = False,
+    current_user: User = Depends(get_admitted_user)
 ):
     # Get customer summary
-    customer_summary = await get_customer_summary(customer_id, current_user)
+    customer_summary = await get_customer_summary(
+        customer_id, include_archive=include_archive, current_user=current_user
+    )
     
     customer = customer_summary['customer']
     workshop_name = current_user.workshop_name or f"Bengkel {current_user.username}"
@@ -502,9 +1536,7 @@ async def generate_whatsapp_message(
     ])
     
     message_text = "\n".join(message_lines)
-    phone = customer['phone'].replace('+', '').replace('-', '').replace(' ', '')
-    if phone.startswith('0'):
-        phone = '62' + phone[1:]
+    phone = customer.get('phone_normalized') or normalize_phone(customer['phone'])
     
     whatsapp_url = f"https://wa.me/{phone}?text={urllib.parse.quote(message_text)}"
     
@@ -513,11 +1545,254 @@ async def generate_whatsapp_message(
         "whatsapp_url": whatsapp_url
     }
 
+# Invoices
+async def load_invoices(session_ids: List[str], workshop_id: str, workshop_name: str) -> Dict[str, tuple]:
+    """Invoice data of each found session with its version, from the hot tier or the archive"""
+    # Read from the primary: invoices are usually printed right after the last edit
+    sessions = {}
+    tiers = {}
+    for tier in [HOT_TIER, ARCHIVE_TIER]:
+        missing = [session_id for session_id in session_ids if session_id not in sessions]
+        if not missing:
+            break
+        async for session in db[tier["service_sessions"]].find(
+            {"workshop_id": workshop_id, "id": {"$in": missing}}, {"_id": 0}
+        ):
+            sessions[session['id']] = session
+            tiers[session['id']] = tier
+    if not sessions:
+        return {}
+    
+    lines = {session_id: {"services": [], "payments": []} for session_id in sessions}
+    for tier in [HOT_TIER, ARCHIVE_TIER]:
+        tier_ids = [session_id for session_id, session_tier in tiers.items() if session_tier is tier]
+        if not tier_ids:
+            continue
+        for collection, sort_field in [("services", "created_at"), ("payments", "payment_date")]:
+            async for document in db[tier[collection]].find(
+                {"workshop_id": workshop_id, "service_session_id": {"$in": tier_ids}}, {"_id": 0}
+            ).sort(sort_field, 1):
+                lines[document['service_session_id']][collection].append(document)
+    customers = {
+        customer['id']: customer
+        async for customer in db.customers.find(
+            {"workshop_id": workshop_id, "id": {"$in": list({s['customer_id'] for s in sessions.values()})}}, {"_id": 0}
+        )
+    }
+    
+    invoices = {}
+    for session_id, session in sessions.items():
+        customer = customers.get(session['customer_id'], {"name": "-", "phone": "-"})
+        documents = [customer, session, *lines[session_id]['services'], *lines[session_id]['payments']]
+        # Any edit bumps updated_at; deletes change the line counts
+        version = (
+            workshop_name,
+            max(document.get('updated_at') or datetime.min for document in documents).isoformat(),
+            len(lines[session_id]['services']),
+            len(lines[session_id]['payments']),
+        )
+        invoices[session_id] = (version, {
+            "workshop_name": workshop_name,
+            "customer": customer,
+            "session": session,
+            **lines[session_id],
+        })
+    return invoices
+
+def invoice_etag(session_id: str, version: tuple) -> str:
+    return '"' + hashlib.sha1(repr((session_id, version)).encode()).hexdigest() + '"'
+
+@api_router.get("/service-sessions/{session_id}/invoice.pdf")
+async def get_invoice_pdf(
+    session_id: str,
+    if_none_match: Optional[str] = Header(None),
+    current_user: User = Depends(get_admitted_user)
+):
+    workshop_name = current_user.workshop_name or f"Bengkel {current_user.username}"
+    invoices = await load_invoices([session_id], current_user.workshop_id, workshop_name)
+    if session_id not in invoices:
+        raise HTTPException(status_code=404, detail="Service session not found")
+    
+    version, invoice = invoices[session_id]
+    etag = invoice_etag(session_id, version)
+    if if_none_match == etag:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+    document = await invoice_renderer.render((current_user.workshop_id, session_id, version), invoice)
+    return Response(document, media_type="application/pdf", headers={
+        "ETag": etag,
+        "Content-Disposition": f'inline; filename="invoice-{session_id[:8]}.pdf"',
+    })
+
+@api_router.post("/service-sessions/invoices")
+async def get_invoice_archive(request: InvoiceBatchRequest, current_user: User = Depends(get_admitted_user)):
+    """Render many invoices concurrently and return them as one zip archive"""
+    workshop_name = current_user.workshop_name or f"Bengkel {current_user.username}"
+    session_ids = list(dict.fromkeys(request.session_ids))
+    invoices = await load_invoices(session_ids, current_user.workshop_id, workshop_name)
+    if not invoices:
+        raise HTTPException(status_code=404, detail="Service sessions not found")
+    
+    found = [session_id for session_id in session_ids if session_id in invoices]
+    documents = await asyncio.gather(*[
+        invoice_renderer.render((current_user.workshop_id, session_id, invoices[session_id][0]), invoices[session_id][1])
+        for session_id in found
+    ])
+    
+    def build_archive():
+        buffer = io.BytesIO()
+        # PDFs written by invoice.py are uncompressed text, so deflate pays off
+        with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+            for session_id, document in zip(found, documents):
+                archive.writestr(f"invoice-{session_id}.pdf", document)
+        return buffer.getvalue()
+    
+    headers = {"Content-Disposition": 'attachment; filename="invoices.zip"'}
+    missing = [session_id for session_id in session_ids if session_id not in invoices]
+    if missing:
+        headers["X-Not-Found"] = ",".join(missing)
+    return Response(await asyncio.to_thread(build_archive), media_type="application/zip", headers=headers)
+
+# Background Jobs
+PURGE_BATCH_SIZE = 1000
+
+async def purge_customer_data(job: dict):
+    """Delete everything that belonged to a deleted customer"""
+    workshop_id = job['workshop_id']
+    customer_id = job['params']['customer_id']
+    related_filter = {"customer_id": customer_id, "workshop_id": workshop_id}
+    
+    # Delete by the ids that were read, so offline clients get a tombstone for
+    # every removed document; repeat until documents added meanwhile are gone too
+    deleted_counts = {}
+    for collection in ["service_sessions", "services", "payments"]:
+        deleted_counts[collection] = 0
+        while True:
+            documents = await db[collection].find(related_filter, {"_id": 0, "id": 1}).to_list(PURGE_BATCH_SIZE)
+            if not documents:
+                break
+            deleted_ids = [document['id'] for document in documents]
+            await db[collection].delete_many({"id": {"$in": deleted_ids}, **related_filter})
+            await write_tombstones(workshop_id, {collection: deleted_ids})
+            deleted_counts[collection] += len(deleted_ids)
+    for archive in ARCHIVE_COLLECTIONS.values():
+        await db[archive].delete_many(related_filter)
+    await db[ROLLUP_COLLECTION].delete_one(related_filter)
+    
+    await response_cache.invalidate(workshop_id, "dashboard", f"customer:{customer_id}")
+    return deleted_counts
+
+async def archive_workshop(job: dict):
+    older_than_days = job['params'].get('older_than_days') or ARCHIVE_AFTER_DAYS
+    stats = await archive_settled_sessions(
+        db, job['workshop_id'], timedelta(days=older_than_days), batch_size=ARCHIVE_BATCH_SIZE
+    )
+    if stats["archived_sessions"]:
+        await response_cache.invalidate(job['workshop_id'], "dashboard", "summary")
+    return stats
+
+async def generate_whatsapp_batch(job: dict):
+    """WhatsApp messages for many customers, as submitted by a user"""
+    user = await db.users.find_one({"username": job['created_by'], "workshop_id": job['workshop_id']})
+    if user is None:
+        raise ValueError("Submitting user no longer exists")
+    current_user = User(**{k: v for k, v in user.items() if k not in ['password', '_id']})
+    
+    messages = []
+    for customer_id in job['params'].get('customer_ids', []):
+        try:
+            message = await generate_whatsapp_message(customer_id, current_user=current_user)
+            messages.append({"customer_id": customer_id, **message})
+        except HTTPException as error:
+            messages.append({"customer_id": customer_id, "error": error.detail})
+    return {"messages": messages}
+
+job_queue.register("purge_customer_data", purge_customer_data)
+job_queue.register("archive", archive_workshop)
+job_queue.register("whatsapp_batch", generate_whatsapp_batch)
+
+@api_router.post("/jobs", status_code=status.HTTP_202_ACCEPTED)
+async def submit_job(job_data: JobCreate, current_user: User = Depends(get_current_user)):
+    if job_data.type == "archive" and current_user.role != "owner":
+        raise HTTPException(status_code=403, detail="Only workshop owners can archive history")
+    
+    return await job_queue.submit(job_data.type, job_data.params.dict(), current_user.workshop_id, current_user.username)
+
+@api_router.get("/jobs/{job_id}")
+async def get_job(job_id: str, current_user: User = Depends(get_current_user)):
+    job = await job_queue.get(job_id, current_user.workshop_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+# Cache Statistics
+@api_router.get("/cache/stats", dependencies=[Depends(require_admin)])
+async def get_cache_stats():
+    return response_cache.stats()
+
+# Write Batch Statistics
+@api_router.get("/write-batches/stats", dependencies=[Depends(require_admin)])
+async def get_write_batch_stats():
+    return write_batcher.stats()
+
+# Workshop Snapshots
+@api_router.get("/admin/workshops/{workshop_id}/snapshot", dependencies=[Depends(require_admin)])
+async def export_workshop_snapshot(workshop_id: str):
+    """Stream every document of a workshop as gzip-compressed NDJSON, read from the primary"""
+    throughput = Throughput()
+    
+    async def stream():
+        async for block in gzip_stream(export_lines(db, workshop_id, SNAPSHOT_CHUNK_SIZE, throughput), throughput):
+            yield block
+        logger.info("Exported workshop %s: %s", workshop_id, throughput.report())
+    
+    return StreamingResponse(stream(), media_type="application/gzip", headers={
+        "Content-Disposition": f'attachment; filename="workshop-{workshop_id}.ndjson.gz"',
+    })
+
+@api_router.post("/admin/workshops/{workshop_id}/restore", dependencies=[Depends(require_admin)])
+async def restore_workshop_snapshot(workshop_id: str, request: Request):
+    """Load a snapshot sent as the raw request body"""
+    throughput = Throughput()
+    try:
+        report = await restore_lines(
+            db, gunzip_lines(request.stream(), throughput), SNAPSHOT_RESTORE_CONCURRENCY, throughput, workshop_id
+        )
+    except (SnapshotError, ValueError, zlib.error) as error:
+        raise HTTPException(status_code=400, detail=f"Invalid snapshot: {error}")
+    await response_cache.invalidate(workshop_id, "dashboard", "summary")
+    logger.info("Restored workshop %s: %s", workshop_id, report)
+    return report
+
 # Default route
 @api_router.get("/")
 async def root():
     return {"message": "Workshop Management System API"}
 
+# Health Checks
+HEALTH_PING_TIMEOUT_SECONDS = float(os.environ.get('HEALTH_PING_TIMEOUT_SECONDS', '2'))
+# Set once startup finished warming up, cleared when shutdown begins
+readiness = {"ready": False}
+
+@api_router.get("/health/live")
+async def liveness():
+    """The process is up and its event loop responds"""
+    return {"status": "ok"}
+
+@api_router.get("/health/ready")
+async def readiness_check(response: Response):
+    """Whether this worker should receive traffic, with the Mongo round trip time"""
+    started = time.perf_counter()
+    try:
+        await asyncio.wait_for(client.admin.command("ping"), HEALTH_PING_TIMEOUT_SECONDS)
+        mongo = {"ok": True, "ping_ms": round((time.perf_counter() - started) * 1000, 2)}
+    except Exception as error:
+        mongo = {"ok": False, "error": str(error) or type(error).__name__}
+    
+    ready = readiness['ready'] and mongo['ok']
+    if not ready:
+        response.status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    return {"status": "ready" if ready else "unavailable", "accepting": readiness['ready'], "mongo": mongo}
+
 # Include the router in the main app
 app.include_router(api_router)
 
@@ -529,6 +1804,17 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Only installed when configured so unprofiled deployments pay nothing
+if ADMIN_TOKEN or PROFILE_SAMPLE_RATE > 0:
+    app.add_middleware(
+        ProfilingMiddleware,
+        output_dir=PROFILE_DIR,
+        admin_token=ADMIN_TOKEN,
+        sample_rate=PROFILE_SAMPLE_RATE,
+        interval=PROFILE_INTERVAL_MS / 1000,
+        max_files=PROFILE_MAX_FILES,
+    )
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -536,6 +1822,156 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Long-running tasks started at startup, cancelled at shutdown
+background_tasks = set()
+
+async def run_migration(name: str, migration):
+    """Run a one-off data migration unless it already completed"""
+    if await db.migrations.find_one({"_id": name}):
+        return
+    logger.info("Running migration %s", name)
+    await migration()
+    await db.migrations.insert_one({"_id": name, "completed_at": datetime.utcnow()})
+
+async def backfill_updated_at():
+    date_fields = {
+        "customers": "created_at",
+        "service_sessions": "session_date",
+        "services": "created_at",
+        "payments": "payment_date",
+    }
+    for collection, date_field in date_fields.items():
+        await db[collection].update_many(
+            {"updated_at": {"$exists": False}},
+            [{"$set": {"updated_at": {"$ifNull": [f"${date_field}", "$$NOW"]}}}]
+        )
+
+async def recompute_customer_debt():
+    """Initialise the stored total_debt from services, payments and archive rollups"""
+    debts = defaultdict(float)
+    for collection, amount_field, sign in [("services", "price", 1), ("payments", "amount", -1)]:
+        async for row in db[collection].aggregate([
+            {"$group": {"_id": {"workshop_id": "$workshop_id", "customer_id": "$customer_id"}, "total": {"$sum": f"${amount_field}"}}}
+        ]):
+            debts[(row['_id']['workshop_id'], row['_id']['customer_id'])] += sign * row['total']
+    async for rollup in db[ROLLUP_COLLECTION].find({}, {"_id": 0}):
+        debts[(rollup['workshop_id'], rollup['customer_id'])] += rollup['services_total'] - rollup['payments_total']
+    
+    await db.customers.update_many({}, {"$set": {"total_debt": 0.0}})
+    updates = [
+        UpdateOne({"id": customer_id, "workshop_id": workshop_id}, {"$set": {"total_debt": debt}})
+        for (workshop_id, customer_id), debt in debts.items() if debt
+    ]
+    for start in range(0, len(updates), 1000):
+        await db.customers.bulk_write(updates[start:start + 1000], ordered=False)
+
+async def build_service_suggestions():
+    await suggestions.rebuild([db.services, db[ARCHIVE_COLLECTIONS["services"]]])
+
+async def normalize_customer_phones():
+    """Store phone_normalized on existing customers, oldest first"""
+    seen = {}
+    updates = []
+    async for customer in db.customers.find({}, {"_id": 0, "id": 1, "workshop_id": 1, "phone": 1}).sort("created_at", 1):
+        phone_normalized = normalize_phone(customer.get('phone') or "") or None
+        key = (customer['workshop_id'], phone_normalized)
+        if phone_normalized and key in seen:
+            # Later duplicates stay visible but are left out of the unique index for manual merging
+            logger.warning("Customer %s duplicates the phone number of customer %s", customer['id'], seen[key])
+            update = {"$set": {"phone_normalized": None, "duplicate_of": seen[key]}}
+        else:
+            seen[key] = customer['id']
+            update = {"$set": {"phone_normalized": phone_normalized}}
+        updates.append(UpdateOne({"id": customer['id'], "workshop_id": customer['workshop_id']}, update))
+    for start in range(0, len(updates), 1000):
+        await db.customers.bulk_write(updates[start:start + 1000], ordered=False)
+
+async def ensure_indexes():
+    for collection in SYNC_COLLECTIONS:
+        await db[collection].create_index([("workshop_id", 1), ("updated_at", 1), ("id", 1)])
+    await db.customers.create_index([("workshop_id", 1), ("total_debt", -1)])
+    await db.customers.create_index(
+        [("workshop_id", 1), ("phone_normalized", 1)],
+        unique=True,
+        partialFilterExpression={"phone_normalized": {"$type": "string"}},
+    )
+    await db.services.create_index("service_session_id")
+    # Per-customer totals of the dashboard
+    for collection in ["service_sessions", "services", "payments"]:
+        await db[collection].create_index([("workshop_id", 1), ("customer_id", 1)])
+    for collection in ["users", "customers", "service_sessions", "services", "payments"]:
+        await db[collection].create_index("id")
+    # Indonesian has no Mongo text analyzer, so index raw words without stemming
+    for collection in ["services", ARCHIVE_COLLECTIONS["services"]]:
+        await db[collection].create_index(
+            [("workshop_id", 1), ("description", "text")], default_language="none", name="description_search"
+        )
+    await db.payments.create_index("service_session_id")
+    # Covers the revenue aggregation of the owner dashboard
+    await db.payments.create_index([("workshop_id", 1), ("amount", 1)])
+    await db.workshop_links.create_index([("owner_id", 1), ("workshop_id", 1)], unique=True)
+    await db.workshop_links.create_index("workshop_id")
+    await db.tombstones.create_index([("workshop_id", 1), ("deleted_at", 1)])
+    await db.tombstones.create_index("deleted_at", expireAfterSeconds=TOMBSTONE_RETENTION_DAYS * 24 * 3600)
+
+async def prepare_storage():
+    """Run pending migrations and create indexes; safe to repeat"""
+    await run_migration("backfill_updated_at", backfill_updated_at)
+    await run_migration("recompute_customer_debt", recompute_customer_debt)
+    await run_migration("normalize_customer_phones", normalize_customer_phones)
+    await ensure_indexes()
+    await ensure_archive_indexes(db)
+    await suggestions.ensure_indexes()
+    await refresh_tokens.ensure_indexes()
+    await run_migration("build_service_suggestions", build_service_suggestions)
+    await job_queue.ensure_indexes(JOB_RETENTION_DAYS)
+
+# Set by the production launcher (serve.py), which prepares storage once before starting workers
+STORAGE_PREPARED = os.environ.get('STORAGE_PREPARED', 'false').lower() == 'true'
+
+@app.on_event("startup")
+async def prepare_database():
+    # Opens the connection pool before the first request needs it
+    await client.admin.command("ping")
+    if not STORAGE_PREPARED:
+        await prepare_storage()
+    job_queue.start()
+    await invoice_renderer.start()
+    await suggestions.prime(SUGGEST_WARM_WORKSHOPS)
+    if ARCHIVE_INTERVAL_HOURS > 0:
+        background_tasks.add(asyncio.create_task(archive_periodically()))
+    readiness['ready'] = True
+
+async def claim_archive_run() -> bool:
+    """Claim the current interval's archive run; every worker process tries, one wins"""
+    now = datetime.utcnow()
+    try:
+        await db.schedules.find_one_and_update(
+            {"_id": "archive", "next_run_at": {"$lte": now}},
+            {"$set": {"next_run_at": now + timedelta(hours=ARCHIVE_INTERVAL_HOURS)}},
+            upsert=True,
+        )
+    except DuplicateKeyError:
+        # The schedule exists but is not due: another process claimed this run
+        return False
+    return True
+
+async def archive_periodically():
+    while True:
+        await asyncio.sleep(ARCHIVE_INTERVAL_HOURS * 3600)
+        try:
+            if await claim_archive_run():
+                for workshop_id in await db.users.distinct("workshop_id", {"role": "owner"}):
+                    await job_queue.submit("archive", {}, workshop_id)
+        except PyMongoError:
+            logger.exception("Submitting the periodic archive run failed")
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    readiness['ready'] = False
+    for task in background_tasks:
+        task.cancel()
+    await job_queue.stop()
+    await write_batcher.close()
+    invoice_renderer.shutdown()
     client.close()
\ No newline at end of file
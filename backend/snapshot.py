@@ -0,0 +1,294 @@
+"""Snapshot export and restore of a single workshop.
+
+A snapshot is gzip-compressed NDJSON in MongoDB canonical extended JSON, so
+dates, integers and ObjectIds survive the round trip. The first line is a
+header. Each following line is one chunk of up to ``chunk_size`` documents
+of one collection, and the last line lists the document counts so a
+truncated file is detected::
+
+    {"format": "workshop-snapshot", "version": 1, "workshop_id": ..., "exported_at": ...}
+    {"collection": "customers", "documents": [...]}
+    {"end": true, "counts": {"customers": 1200, ...}}
+
+Export and restore both stream one chunk at a time, so memory stays constant
+however large the workshop is. Restore inserts chunks in parallel, bounded by
+``concurrency``. Documents whose ``_id`` already exists are skipped, so an
+interrupted restore can simply be run again. A document rejected by another
+unique index (a phone number another customer already has) is reported as a
+conflict, and users whose username is already taken stop the restore.
+
+Command line, run from the repository root::
+
+    python -m backend.snapshot export <workshop_id> <file.ndjson.gz>
+    python -m backend.snapshot restore <file.ndjson.gz>
+"""
+import argparse
+import asyncio
+import logging
+import os
+import time
+import zlib
+from collections import Counter
+from datetime import datetime
+from pathlib import Path
+from typing import AsyncIterable, AsyncIterator, Iterable, Optional, Tuple
+
+from bson import json_util
+from bson.json_util import CANONICAL_JSON_OPTIONS
+from pymongo.errors import BulkWriteError
+
+logger = logging.getLogger(__name__)
+
+FORMAT = "workshop-snapshot"
+VERSION = 1
+# Everything scoped to a workshop except derived or credential data
+# (tombstones, jobs, refresh tokens), which the target rebuilds on its own
+SNAPSHOT_COLLECTIONS = [
+    "users",
+    "customers",
+    "service_sessions",
+    "services",
+    "payments",
+    "archived_service_sessions",
+    "archived_services",
+    "archived_payments",
+    "customer_archive_rollups",
+    "service_suggestions",
+]
+DUPLICATE_KEY_ERROR = 11000
+
+
+class SnapshotError(ValueError):
+    pass
+
+
+def _line(record: dict) -> bytes:
+    return json_util.dumps(record, json_options=CANONICAL_JSON_OPTIONS).encode() + b"\n"
+
+
+class Throughput:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.counts = Counter()
+        self.bytes = 0
+
+    def report(self, **extra) -> dict:
+        seconds = time.perf_counter() - self.started
+        documents = sum(self.counts.values())
+        return {
+            "counts": dict(self.counts),
+            "documents": documents,
+            "bytes": self.bytes,
+            "seconds": round(seconds, 3),
+            "documents_per_second": round(documents / seconds, 1) if seconds else 0.0,
+            "megabytes_per_second": round(self.bytes / seconds / 1e6, 2) if seconds else 0.0,
+            **extra,
+        }
+
+
+async def export_lines(db, workshop_id: str, chunk_size: int = 1000,
+                       throughput: Optional[Throughput] = None) -> AsyncIterator[bytes]:
+    """Yield the uncompressed NDJSON lines of a workshop snapshot"""
+    throughput = throughput or Throughput()
+    yield _line({"format": FORMAT, "version": VERSION, "workshop_id": workshop_id, "exported_at": datetime.utcnow()})
+    for collection in SNAPSHOT_COLLECTIONS:
+        chunk = []
+        async for document in db[collection].find({"workshop_id": workshop_id}, batch_size=chunk_size):
+            chunk.append(document)
+            if len(chunk) == chunk_size:
+                throughput.counts[collection] += len(chunk)
+                yield _line({"collection": collection, "documents": chunk})
+                chunk = []
+        if chunk:
+            throughput.counts[collection] += len(chunk)
+            yield _line({"collection": collection, "documents": chunk})
+    yield _line({"end": True, "counts": dict(throughput.counts)})
+
+
+async def gzip_stream(lines: AsyncIterable[bytes], throughput: Optional[Throughput] = None,
+                      level: int = 6) -> AsyncIterator[bytes]:
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)  # 31: gzip container
+    async for line in lines:
+        compressed = compressor.compress(line)
+        if compressed:
+            if throughput:
+                throughput.bytes += len(compressed)
+            yield compressed
+    tail = compressor.flush()
+    if throughput:
+        throughput.bytes += len(tail)
+    yield tail
+
+
+async def gunzip_lines(chunks: AsyncIterable[bytes], throughput: Optional[Throughput] = None) -> AsyncIterator[bytes]:
+    """Split a streamed gzip body into lines without holding more than one line"""
+    decompressor = zlib.decompressobj(31)
+    buffer = b""
+    async for chunk in chunks:
+        if throughput:
+            throughput.bytes += len(chunk)
+        buffer += decompressor.decompress(chunk)
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            yield line
+    buffer += decompressor.flush()
+    if buffer:
+        yield buffer
+
+
+async def _insert_chunk(db, collection: str, documents: list) -> Tuple[int, list]:
+    """Insert a chunk, returning how many documents already existed and the ``_id``s that conflicted"""
+    try:
+        await db[collection].insert_many(documents, ordered=False)
+    except BulkWriteError as error:
+        if any(e["code"] != DUPLICATE_KEY_ERROR for e in error.details["writeErrors"]):
+            raise
+        rejected = [documents[e["index"]]["_id"] for e in error.details["writeErrors"]]
+        # Only a document with the same _id means it was restored before
+        existing = {
+            document["_id"]
+            for document in await db[collection].find({"_id": {"$in": rejected}}, {"_id": 1}).to_list(None)
+        }
+        return len(existing), [document_id for document_id in rejected if document_id not in existing]
+    return 0, []
+
+
+async def _check_usernames(db, users: list):
+    """Fail when a username is taken by a different user, since users sign in by username"""
+    taken = await db.users.find(
+        {"username": {"$in": [user["username"] for user in users]}, "id": {"$nin": [user["id"] for user in users]}},
+        {"_id": 0, "username": 1},
+    ).to_list(None)
+    if taken:
+        raise SnapshotError(f"Usernames already taken: {', '.join(sorted(user['username'] for user in taken))}")
+
+
+async def restore_lines(db, lines: AsyncIterable[bytes], concurrency: int = 4,
+                        throughput: Optional[Throughput] = None, workshop_id: Optional[str] = None) -> dict:
+    """Insert the snapshot ``lines`` into ``db``, ``concurrency`` chunks at a time"""
+    throughput = throughput or Throughput()
+    semaphore = asyncio.Semaphore(concurrency)
+    inserts = set()
+    skipped = Counter()
+    conflicts = {}
+    header = None
+    expected = None
+
+    async def insert(collection, documents):
+        try:
+            existing, conflicting = await _insert_chunk(db, collection, documents)
+            skipped[collection] += existing
+            if conflicting:
+                conflicts.setdefault(collection, []).extend(conflicting)
+            throughput.counts[collection] += len(documents)
+        finally:
+            semaphore.release()
+
+    try:
+        async for line in lines:
+            if not line.strip():
+                continue
+            record = json_util.loads(line, json_options=CANONICAL_JSON_OPTIONS)
+            if header is None:
+                if record.get("format") != FORMAT or record.get("version") != VERSION:
+                    raise SnapshotError("Not a workshop snapshot")
+                if workshop_id is not None and record["workshop_id"] != workshop_id:
+                    raise SnapshotError(f"Snapshot belongs to workshop {record['workshop_id']}")
+                header = record
+                continue
+            if record.get("end"):
+                expected = record["counts"]
+                break
+            collection = record.get("collection")
+            if collection not in SNAPSHOT_COLLECTIONS:
+                raise SnapshotError(f"Unexpected collection {collection!r}")
+            if any(document.get("workshop_id") != header["workshop_id"] for document in record["documents"]):
+                raise SnapshotError(f"{collection} chunk contains documents of another workshop")
+            if collection == "users":
+                await _check_usernames(db, record["documents"])
+
+            # Wait for a free slot before reading further, which bounds memory
+            await semaphore.acquire()
+            for task in [task for task in inserts if task.done()]:
+                inserts.discard(task)
+                task.result()
+            inserts.add(asyncio.ensure_future(insert(collection, record["documents"])))
+        if inserts:
+            await asyncio.gather(*inserts)
+    except BaseException:
+        for task in inserts:
+            task.cancel()
+        raise
+
+    if header is None:
+        raise SnapshotError("Empty snapshot")
+    report = throughput.report(
+        workshop_id=header["workshop_id"],
+        skipped_existing=dict(skipped),
+        conflicts={collection: len(ids) for collection, ids in conflicts.items()},
+        complete=expected is not None and expected == dict(throughput.counts) and not conflicts,
+    )
+    for collection, ids in conflicts.items():
+        logger.warning("%d %s documents conflict with a unique index, e.g. _id %s",
+                       len(ids), collection, ", ".join(map(str, ids[:10])))
+    if not report["complete"]:
+        logger.warning("Snapshot of %s restored incompletely: expected %s", header["workshop_id"], expected)
+    return report
+
+
+async def _read_file(path: Path, block_size: int = 1 << 16) -> AsyncIterator[bytes]:
+    with open(path, "rb") as file:
+        while True:
+            block = await asyncio.to_thread(file.read, block_size)
+            if not block:
+                return
+            yield block
+
+
+async def _export_file(db, workshop_id: str, path: Path, chunk_size: int) -> dict:
+    throughput = Throughput()
+    with open(path, "wb") as file:
+        async for block in gzip_stream(export_lines(db, workshop_id, chunk_size, throughput), throughput):
+            file.write(block)
+    return throughput.report(workshop_id=workshop_id)
+
+
+async def _restore_file(db, path: Path, concurrency: int) -> dict:
+    throughput = Throughput()
+    return await restore_lines(db, gunzip_lines(_read_file(path), throughput), concurrency, throughput)
+
+
+def main(argv: Optional[Iterable[str]] = None):
+    from dotenv import load_dotenv
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    load_dotenv(Path(__file__).parent / '.env')
+    parser = argparse.ArgumentParser(description="Export or restore one workshop's data")
+    parser.add_argument("--mongo-url", default=os.environ.get('MONGO_URL'))
+    parser.add_argument("--db", default=os.environ.get('DB_NAME'))
+    commands = parser.add_subparsers(dest="command", required=True)
+    export = commands.add_parser("export")
+    export.add_argument("workshop_id")
+    export.add_argument("path", type=Path)
+    export.add_argument("--chunk-size", type=int, default=1000)
+    restore = commands.add_parser("restore")
+    restore.add_argument("path", type=Path)
+    restore.add_argument("--concurrency", type=int, default=4)
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    async def run():
+        client = AsyncIOMotorClient(args.mongo_url)
+        try:
+            db = client[args.db]
+            if args.command == "export":
+                return await _export_file(db, args.workshop_id, args.path, args.chunk_size)
+            return await _restore_file(db, args.path, args.concurrency)
+        finally:
+            client.close()
+
+    logger.info("%s finished: %s", args.command.capitalize(), asyncio.run(run()))
+
+
+if __name__ == "__main__":
+    main()
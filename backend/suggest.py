@@ -0,0 +1,202 @@
+"""Autocomplete for service descriptions and their typical prices.
+
+``service_suggestions`` holds one document per workshop and normalised
+description, counting how often it was used and at which prices. Service
+writes keep it current with ``$inc``, so suggestions never read the services
+collection.
+
+Lookups are served from ``SuggestionIndex``, a sorted in-memory list per
+workshop searched with bisect. Indexes are loaded on first use, evicted
+least recently used beyond ``max_workshops``, and reloaded after ``max_age``
+seconds so writes made through other worker processes show up.
+"""
+import bisect
+import heapq
+import time
+from collections import OrderedDict, defaultdict
+from datetime import datetime
+from typing import Iterable, List, Tuple
+
+from pymongo import UpdateOne
+
+
+def normalize_description(description: str) -> str:
+    return " ".join(description.split()).casefold()
+
+
+def price_key(price: float) -> str:
+    # Prices are stored as integer cents so they are valid field names
+    return str(round(price * 100))
+
+
+class SuggestionIndex:
+    """Prefix lookup over the suggestion entries of one workshop"""
+
+    def __init__(self, entries: Iterable[dict] = ()):
+        self._entries = {entry["key"]: entry for entry in entries}
+        self._keys = sorted(self._entries)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def apply(self, key: str, description: str, price: float, delta: int):
+        entry = self._entries.get(key)
+        if entry is None:
+            if delta <= 0:
+                return
+            entry = {"key": key, "description": description, "count": 0, "prices": {}, "last_price": price}
+            self._entries[key] = entry
+            bisect.insort(self._keys, key)
+
+        cents = price_key(price)
+        entry["count"] += delta
+        entry["prices"][cents] = entry["prices"].get(cents, 0) + delta
+        if delta > 0:
+            entry["description"] = description
+            entry["last_price"] = price
+        if entry["count"] <= 0:
+            del self._entries[key]
+            del self._keys[bisect.bisect_left(self._keys, key)]
+
+    def search(self, prefix: str, limit: int) -> List[dict]:
+        """Return the ``limit`` most used entries starting with ``prefix``"""
+        start = bisect.bisect_left(self._keys, prefix)
+        matches = []
+        for key in self._keys[start:]:
+            if not key.startswith(prefix):
+                break
+            matches.append(self._entries[key])
+        return heapq.nlargest(limit, matches, key=lambda entry: (entry["count"], entry["key"]))
+
+
+def typical_price(entry: dict) -> float:
+    """The most used price, preferring the latest one on ties"""
+    last = price_key(entry["last_price"])
+    cents, _ = max(
+        ((cents, count) for cents, count in entry["prices"].items() if count > 0),
+        key=lambda item: (item[1], item[0] == last),
+        default=(last, 0),
+    )
+    return int(cents) / 100
+
+
+class SuggestionStore:
+    def __init__(self, collection, max_workshops: int = 200, max_entries: int = 5000, max_age: float = 300,
+                 clock=time.monotonic):
+        self.collection = collection
+        self.max_workshops = max_workshops
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self._clock = clock
+        # workshop_id -> (index, loaded_at), least recently used first
+        self._indexes: "OrderedDict[str, tuple]" = OrderedDict()
+
+    async def ensure_indexes(self):
+        await self.collection.create_index([("workshop_id", 1), ("key", 1)], unique=True)
+        await self.collection.create_index([("workshop_id", 1), ("count", -1)])
+
+    async def record(self, workshop_id: str, description: str, price: float, delta: int = 1):
+        """Count one use (or, with a negative delta, removal) of a description and price"""
+        await self.record_many(workshop_id, [(description, price, delta)])
+
+    async def record_many(self, workshop_id: str, uses: Iterable[Tuple[str, float, int]]):
+        """Apply several ``(description, price, delta)`` uses with one bulk write"""
+        updates = []
+        applied = []
+        removed_keys = set()
+        now = datetime.utcnow()
+        for description, price, delta in uses:
+            key = normalize_description(description)
+            if not key:
+                continue
+            update = {"$inc": {"count": delta, f"prices.{price_key(price)}": delta}}
+            if delta > 0:
+                update["$set"] = {"description": description.strip(), "last_price": price, "last_used_at": now}
+            else:
+                removed_keys.add(key)
+            updates.append(UpdateOne({"workshop_id": workshop_id, "key": key}, update, upsert=delta > 0))
+            applied.append((key, description.strip(), price, delta))
+        if not updates:
+            return
+        # Ordered, so a removal and a re-add of the same description apply in sequence
+        await self.collection.bulk_write(updates)
+        if removed_keys:
+            await self.collection.delete_many(
+                {"workshop_id": workshop_id, "key": {"$in": sorted(removed_keys)}, "count": {"$lte": 0}}
+            )
+
+        cached = self._indexes.get(workshop_id)
+        if cached is not None:
+            for use in applied:
+                cached[0].apply(*use)
+
+    async def suggest(self, workshop_id: str, prefix: str, limit: int = 10) -> List[dict]:
+        index = await self._index(workshop_id)
+        return [
+            {"description": entry["description"], "price": typical_price(entry), "count": entry["count"]}
+            for entry in index.search(normalize_description(prefix), limit)
+        ]
+
+    async def prime(self, workshops: int):
+        """Load the indexes of the most recently active workshops"""
+        if workshops <= 0:
+            return
+        recent = await self.collection.aggregate([
+            {"$group": {"_id": "$workshop_id", "last_used_at": {"$max": "$last_used_at"}}},
+            {"$sort": {"last_used_at": -1}},
+            {"$limit": min(workshops, self.max_workshops)},
+        ]).to_list(None)
+        for workshop in reversed(recent):
+            await self._index(workshop["_id"])
+
+    async def _index(self, workshop_id: str) -> SuggestionIndex:
+        cached = self._indexes.get(workshop_id)
+        if cached is not None and self._clock() - cached[1] < self.max_age:
+            self._indexes.move_to_end(workshop_id)
+            return cached[0]
+
+        entries = await self.collection.find(
+            {"workshop_id": workshop_id}, {"_id": 0, "key": 1, "description": 1, "count": 1, "prices": 1, "last_price": 1}
+        ).sort("count", -1).to_list(self.max_entries)
+        index = SuggestionIndex(entries)
+        self._indexes[workshop_id] = (index, self._clock())
+        self._indexes.move_to_end(workshop_id)
+        while len(self._indexes) > self.max_workshops:
+            self._indexes.popitem(last=False)
+        return index
+
+    async def rebuild(self, collections):
+        """Recount every workshop's suggestions from the given service collections"""
+        counts = defaultdict(lambda: {"count": 0, "prices": defaultdict(int), "last_used_at": None})
+        for collection in collections:
+            async for row in collection.aggregate([
+                {"$group": {
+                    "_id": {"workshop_id": "$workshop_id", "description": "$description", "price": "$price"},
+                    "count": {"$sum": 1},
+                    "last_used_at": {"$max": "$created_at"},
+                }},
+            ]):
+                group = row["_id"]
+                key = normalize_description(group.get("description") or "")
+                if not key or group.get("price") is None:
+                    continue
+                entry = counts[(group["workshop_id"], key)]
+                entry["count"] += row["count"]
+                entry["prices"][price_key(group["price"])] += row["count"]
+                if entry["last_used_at"] is None or (row["last_used_at"] or datetime.min) > entry["last_used_at"]:
+                    entry.update(description=group["description"].strip(), last_price=group["price"],
+                                 last_used_at=row["last_used_at"] or datetime.min)
+
+        updates = [
+            UpdateOne({"workshop_id": workshop_id, "key": key}, {"$set": {
+                "description": entry["description"],
+                "count": entry["count"],
+                "prices": dict(entry["prices"]),
+                "last_price": entry["last_price"],
+                "last_used_at": entry["last_used_at"],
+            }}, upsert=True)
+            for (workshop_id, key), entry in counts.items()
+        ]
+        for start in range(0, len(updates), 1000):
+            await self.collection.bulk_write(updates[start:start + 1000], ordered=False)
+        self._indexes.clear()
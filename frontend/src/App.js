@@ -23,6 +23,41 @@ import './App.css';
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
 const API = `${BACKEND_URL}/api`;
 
+const storeTokens = ({ access_token, refresh_token }) => {
+  localStorage.setItem('token', access_token);
+  localStorage.setItem('refreshToken', refresh_token);
+  axios.defaults.headers.common['Authorization'] = `Bearer ${access_token}`;
+};
+
+const clearTokens = () => {
+  localStorage.removeItem('token');
+  localStorage.removeItem('refreshToken');
+  delete axios.defaults.headers.common['Authorization'];
+};
+
+// Renew an expired access token with the refresh token instead of signing in again.
+// Concurrent 401s share one refresh, since each refresh token can be used only once.
+let refreshing = null;
+axios.interceptors.response.use(undefined, async (error) => {
+  const request = error.config;
+  const refreshToken = localStorage.getItem('refreshToken');
+  if (error.response?.status !== 401 || !refreshToken || request._retried || request.url === `${API}/auth/refresh`) {
+    return Promise.reject(error);
+  }
+  request._retried = true;
+  try {
+    refreshing = refreshing || axios.post(`${API}/auth/refresh`, { refresh_token: refreshToken })
+      .then((response) => storeTokens(response.data))
+      .finally(() => { refreshing = null; });
+    await refreshing;
+  } catch (refreshError) {
+    clearTokens();
+    return Promise.reject(error);
+  }
+  request.headers['Authorization'] = axios.defaults.headers.common['Authorization'];
+  return axios(request);
+});
+
 // Auth Context
 const AuthContext = React.createContext();
 
@@ -54,8 +89,7 @@ const AuthProvider = ({ children }) => {
       const response = await axios.get(`${API}/auth/me`);
       setUser(response.data);
     } catch (error) {
-      localStorage.removeItem('token');
-      delete axios.defaults.headers.common['Authorization'];
+      clearTokens();
     } finally {
       setLoading(false);
     }
@@ -64,10 +98,9 @@ const AuthProvider = ({ children }) => {
   const login = async (username, password) => {
     try {
       const response = await axios.post(`${API}/auth/login`, { username, password });
-      const { access_token, user: userData } = response.data;
+      const { user: userData } = response.data;
       
-      localStorage.setItem('token', access_token);
-      axios.defaults.headers.common['Authorization'] = `Bearer ${access_token}`;
+      storeTokens(response.data);
       setUser(userData);
       
       toast({
@@ -89,10 +122,9 @@ const AuthProvider = ({ children }) => {
   const register = async (userData) => {
     try {
       const response = await axios.post(`${API}/auth/register`, userData);
-      const { access_token, user: newUser } = response.data;
+      const { user: newUser } = response.data;
       
-      localStorage.setItem('token', access_token);
-      axios.defaults.headers.common['Authorization'] = `Bearer ${access_token}`;
+      storeTokens(response.data);
       setUser(newUser);
       
       toast({
@@ -112,8 +144,11 @@ const AuthProvider = ({ children }) => {
   };
 
   const logout = () => {
-    localStorage.removeItem('token');
-    delete axios.defaults.headers.common['Authorization'];
+    const refreshToken = localStorage.getItem('refreshToken');
+    if (refreshToken) {
+      axios.post(`${API}/auth/logout`, { refresh_token: refreshToken }).catch(() => {});
+    }
+    clearTokens();
     setUser(null);
     toast({
       title: "👋 Sampai jumpa!",
@@ -0,0 +1,167 @@
+import asyncio
+import shutil
+import socket
+import subprocess
+import time
+
+import pytest
+from pymongo.errors import DuplicateKeyError
+
+from admission import (
+    AdmissionController,
+    AdmissionPolicy,
+    InMemoryAdmissionBackend,
+    MongoAdmissionBackend,
+    Rejected,
+)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_token_bucket_rejects_after_burst_and_refills():
+    clock = FakeClock()
+    controller = AdmissionController(InMemoryAdmissionBackend(clock), AdmissionPolicy(rate=2, burst=3, max_concurrent=10))
+
+    async def scenario():
+        for _ in range(3):
+            ticket = await controller.acquire("W1")
+            await controller.release("W1", ticket)
+        with pytest.raises(Rejected) as excinfo:
+            await controller.acquire("W1")
+        assert excinfo.value.retry_after == pytest.approx(0.5)
+        assert excinfo.value.retry_after_header == "1"
+
+        # Other workshops are unaffected
+        await controller.acquire("W2")
+
+        clock.now = 0.5
+        await controller.acquire("W1")
+
+    run(scenario())
+    assert controller.stats == {"admitted": 5, "rejected": 1}
+
+
+def test_concurrency_cap_is_released():
+    controller = AdmissionController(InMemoryAdmissionBackend(FakeClock()), AdmissionPolicy(rate=1, burst=100, max_concurrent=2))
+
+    async def scenario():
+        first = await controller.acquire("W1")
+        await controller.acquire("W1")
+        with pytest.raises(Rejected, match="concurrent"):
+            await controller.acquire("W1")
+        await controller.release("W1", first)
+        await controller.acquire("W1")
+
+    run(scenario())
+
+
+class RacingCollection:
+    """Raises DuplicateKeyError for the first calls of each kind, as a lost upsert race does"""
+
+    def __init__(self, bucket_collisions=0, lease_collisions=0):
+        self.collisions = {"bucket": bucket_collisions, "inflight": lease_collisions}
+        self.refunds = 0
+
+    def _collide(self, document_id):
+        kind = document_id.split(":")[0]
+        if self.collisions[kind]:
+            self.collisions[kind] -= 1
+            raise DuplicateKeyError("E11000 duplicate key")
+
+    async def find_one_and_update(self, query, update, **kwargs):
+        self._collide(query["_id"])
+        return {"admitted": True, "tokens": 4}
+
+    async def update_one(self, query, update, upsert=False):
+        if upsert:
+            self._collide(query["_id"])
+        else:
+            self.refunds += 1
+
+
+def test_mongo_backend_retries_a_lost_creation_race():
+    collection = RacingCollection(bucket_collisions=1, lease_collisions=1)
+    backend = MongoAdmissionBackend(collection, clock=FakeClock())
+
+    ticket = run(backend.acquire("W1", AdmissionPolicy(rate=1, burst=5, max_concurrent=2)))
+    assert ticket and collection.refunds == 0
+
+
+def test_mongo_backend_refunds_the_token_when_concurrency_rejects():
+    collection = RacingCollection(lease_collisions=2)
+    backend = MongoAdmissionBackend(collection, clock=FakeClock())
+
+    with pytest.raises(Rejected, match="concurrent"):
+        run(backend.acquire("W1", AdmissionPolicy(rate=1, burst=5, max_concurrent=2)))
+    assert collection.refunds == 1
+
+
+@pytest.fixture(scope="module")
+def mongo_url(tmp_path_factory):
+    if shutil.which('mongod') is None:
+        pytest.skip("mongod is not installed")
+
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+    process = subprocess.Popen(
+        ['mongod', '--port', str(port), '--bind_ip', '127.0.0.1',
+         '--dbpath', str(tmp_path_factory.mktemp("admission")), '--quiet'],
+        stdout=subprocess.DEVNULL,
+    )
+    try:
+        deadline = time.time() + 30
+        while time.time() < deadline:
+            try:
+                socket.create_connection(('127.0.0.1', port), timeout=0.5).close()
+                break
+            except OSError:
+                time.sleep(0.2)
+        else:
+            pytest.fail("mongod did not start")
+        yield f'mongodb://127.0.0.1:{port}'
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def test_mongo_backend_enforces_rate_and_concurrency(mongo_url):
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    clock = FakeClock()
+
+    async def scenario():
+        client = AsyncIOMotorClient(mongo_url)
+        collection = client['admission_test'].admission
+        await collection.delete_many({})
+        controller = AdmissionController(
+            MongoAdmissionBackend(collection, clock=clock), AdmissionPolicy(rate=1, burst=3, max_concurrent=2)
+        )
+        try:
+            # Concurrent first requests race to create both documents
+            first, second = await asyncio.gather(controller.acquire("W1"), controller.acquire("W1"))
+            with pytest.raises(Rejected, match="concurrent"):
+                await controller.acquire("W1")
+            await controller.release("W1", first)
+            await controller.release("W1", second)
+
+            # The rejected request kept its token, so one is left
+            await controller.release("W1", await controller.acquire("W1"))
+            with pytest.raises(Rejected, match="Rate limit"):
+                await controller.acquire("W1")
+            clock.now = 1.0
+            await controller.acquire("W1")
+        finally:
+            client.close()
+
+    run(scenario())
@@ -0,0 +1,70 @@
+import asyncio
+
+import pytest
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+from batching import InsertBatcher
+
+
+class RecordingCollection:
+    """Collects insert_many calls and rejects documents marked as duplicates"""
+
+    def __init__(self):
+        self.batches = []
+
+    async def insert_many(self, documents, ordered=True):
+        self.batches.append([document["id"] for document in documents])
+        errors = [
+            {"index": index, "code": 11000, "errmsg": "duplicate key"}
+            for index, document in enumerate(documents) if document.get("duplicate")
+        ]
+        if errors:
+            raise BulkWriteError({"writeErrors": errors, "nInserted": len(documents) - len(errors)})
+
+
+def test_concurrent_inserts_share_one_round_trip():
+    collection = RecordingCollection()
+    batcher = InsertBatcher({"services": collection}, window=0.01, max_batch=100)
+
+    async def scenario():
+        return await asyncio.gather(
+            *[batcher.insert("services", {"id": index, "duplicate": index == 2}) for index in range(4)],
+            return_exceptions=True,
+        )
+
+    results = asyncio.run(scenario())
+    assert collection.batches == [[0, 1, 2, 3]]
+    assert results[:2] == [None, None] and results[3] is None
+    assert isinstance(results[2], DuplicateKeyError)
+
+    stats = batcher.stats()
+    assert stats["batches"] == 1 and stats["flushed_window"] == 1
+    assert stats["failed_documents"] == 1 and stats["batch_sizes"] == {"<=4": 1}
+
+
+def test_full_batches_flush_without_waiting_for_the_window():
+    collection = RecordingCollection()
+    batcher = InsertBatcher({"payments": collection}, window=60, max_batch=3)
+
+    async def scenario():
+        await asyncio.wait_for(
+            asyncio.gather(*[batcher.insert("payments", {"id": index}) for index in range(6)]), timeout=1
+        )
+
+    asyncio.run(scenario())
+    assert collection.batches == [[0, 1, 2], [3, 4, 5]]
+    assert batcher.stats()["flushed_full"] == 2
+
+
+def test_errors_of_the_whole_batch_reach_every_caller():
+    class FailingCollection:
+        async def insert_many(self, documents, ordered=True):
+            raise ConnectionError("primary unavailable")
+
+    batcher = InsertBatcher({"services": FailingCollection()}, window=0.001)
+
+    async def scenario():
+        await batcher.insert("services", {"id": 1})
+
+    with pytest.raises(ConnectionError):
+        asyncio.run(scenario())
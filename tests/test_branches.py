@@ -0,0 +1,59 @@
+import asyncio
+
+from branches import branch_totals, merge_totals
+
+
+class Aggregation:
+    def __init__(self, results):
+        self.results = results
+
+    async def to_list(self, length):
+        return self.results[:length]
+
+
+class GroupedCollection:
+    """Answers every aggregation with a fixed $group result"""
+
+    def __init__(self, *results):
+        self.results = list(results)
+        self.pipelines = []
+
+    def aggregate(self, pipeline):
+        self.pipelines.append(pipeline)
+        return Aggregation(self.results)
+
+
+class Database(dict):
+    def __getattr__(self, name):
+        return self[name]
+
+
+def test_branch_totals_add_archived_payments_to_revenue():
+    db = Database(
+        customers=GroupedCollection({"customers": 3, "customers_in_debt": 2, "total_debt": 75000}),
+        payments=GroupedCollection({"payments": 4, "revenue": 120000}),
+        customer_archive_rollups=GroupedCollection({"payments": 10, "revenue": 300000}),
+    )
+    totals = asyncio.run(branch_totals(db, "W1"))
+    assert totals == {
+        "customers": 3, "customers_in_debt": 2, "total_debt": 75000, "payments": 14, "revenue": 420000,
+    }
+    # Every aggregation starts with the indexed workshop match
+    for collection in db.values():
+        assert collection.pipelines[0][0] == {"$match": {"workshop_id": "W1"}}
+
+
+def test_empty_branch_counts_as_zero():
+    db = Database(customers=GroupedCollection(), payments=GroupedCollection(),
+                  customer_archive_rollups=GroupedCollection())
+    totals = asyncio.run(branch_totals(db, "W2"))
+    assert set(totals.values()) == {0}
+
+
+def test_merge_totals_sums_every_field():
+    first = {"customers": 3, "customers_in_debt": 2, "total_debt": 75000, "payments": 14, "revenue": 420000}
+    second = {"customers": 1, "customers_in_debt": 0, "total_debt": 0, "payments": 2, "revenue": 50000}
+    assert merge_totals([first, second]) == {
+        "customers": 4, "customers_in_debt": 2, "total_debt": 75000, "payments": 16, "revenue": 470000,
+    }
+    assert merge_totals([]) == {"customers": 0, "customers_in_debt": 0, "total_debt": 0, "payments": 0, "revenue": 0}
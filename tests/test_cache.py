@@ -0,0 +1,73 @@
+import asyncio
+
+from cache import InMemoryCacheBackend, ResponseCache
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def make_counter():
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        return {"value": len(calls)}
+
+    return calls, compute
+
+
+def test_hit_after_miss_and_precise_invalidation():
+    cache = ResponseCache(InMemoryCacheBackend(max_entries=10))
+    calls, compute = make_counter()
+
+    async def scenario():
+        first = await cache.get_or_compute("W1", "summary", {"customer_id": "c1"}, ["customer:c1"], compute)
+        second = await cache.get_or_compute("W1", "summary", {"customer_id": "c1"}, ["customer:c1"], compute)
+        assert first == second == {"value": 1}
+
+        # Another customer's write leaves the entry alone
+        assert await cache.invalidate("W1", "customer:c2") == 0
+        await cache.get_or_compute("W1", "summary", {"customer_id": "c1"}, ["customer:c1"], compute)
+        assert len(calls) == 1
+
+        assert await cache.invalidate("W1", "customer:c1") == 1
+        third = await cache.get_or_compute("W1", "summary", {"customer_id": "c1"}, ["customer:c1"], compute)
+        assert third == {"value": 2}
+
+    run(scenario())
+    stats = cache.stats()
+    assert stats["hits"] == 2 and stats["misses"] == 2 and stats["invalidations"] == 1
+
+
+def test_lru_eviction_keeps_recently_used_entries():
+    backend = InMemoryCacheBackend(max_entries=2)
+    cache = ResponseCache(backend)
+    _, compute = make_counter()
+
+    async def scenario():
+        for name in ("a", "b"):
+            await cache.get_or_compute("W1", name, {}, [name], compute)
+        await cache.get_or_compute("W1", "a", {}, ["a"], compute)
+        await cache.get_or_compute("W1", "c", {}, ["c"], compute)
+
+        assert await backend.get(cache.key("W1", "a")) == {"value": 1}
+        assert cache.key("W1", "b") not in backend._entries
+        assert backend._tagged.get(("W1", "b")) is None
+
+    run(scenario())
+    assert backend.stats()["evictions"] == 1
+
+
+def test_response_computed_during_invalidation_is_not_stored():
+    cache = ResponseCache(InMemoryCacheBackend())
+
+    async def scenario():
+        async def compute():
+            await cache.invalidate("W1", "dashboard")
+            return {"stale": True}
+
+        await cache.get_or_compute("W1", "dashboard", {}, ["dashboard"], compute)
+        assert cache.stats()["entries"] == 0
+
+    run(scenario())
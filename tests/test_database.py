@@ -0,0 +1,120 @@
+import asyncio
+import shutil
+import socket
+import subprocess
+import time
+
+import pytest
+from pymongo import MongoClient, monitoring
+from pymongo.read_preferences import Primary, SecondaryPreferred
+
+from database import client_options, create_client, read_database, read_preference
+
+
+def test_client_options_from_env():
+    options = client_options({
+        'MONGO_MAX_POOL_SIZE': '20',
+        'MONGO_WAIT_QUEUE_TIMEOUT_MS': '250',
+        'MONGO_COMPRESSORS': 'zstd,zlib',
+    })
+
+    assert options['maxPoolSize'] == 20
+    assert options['minPoolSize'] == 0
+    assert options['waitQueueTimeoutMS'] == 250
+    assert options['compressors'] == 'zstd,zlib'
+
+
+def test_read_preference_defaults_to_secondary_preferred_with_staleness_bound():
+    preference = read_preference({})
+
+    assert isinstance(preference, SecondaryPreferred)
+    assert preference.max_staleness == 90
+    assert isinstance(read_preference({'MONGO_READ_PREFERENCE': 'primary'}), Primary)
+
+
+def test_read_preference_rejects_invalid_settings():
+    with pytest.raises(ValueError):
+        read_preference({'MONGO_READ_PREFERENCE': 'fastest'})
+    with pytest.raises(ValueError):
+        read_preference({'MONGO_READ_MAX_STALENESS_SECONDS': '10'})
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture(scope="module")
+def replica_set(tmp_path_factory):
+    """Two-member local replica set: one primary and one priority-0 secondary."""
+    if shutil.which('mongod') is None:
+        pytest.skip("mongod is not installed")
+
+    ports = [_free_port(), _free_port()]
+    processes = []
+    for index, port in enumerate(ports):
+        dbpath = tmp_path_factory.mktemp(f"rs{index}")
+        processes.append(subprocess.Popen(
+            ['mongod', '--replSet', 'rs0', '--port', str(port), '--bind_ip', '127.0.0.1',
+             '--dbpath', str(dbpath), '--quiet'],
+            stdout=subprocess.DEVNULL,
+        ))
+    try:
+        seed = MongoClient('127.0.0.1', ports[0], directConnection=True)
+        seed.admin.command('replSetInitiate', {
+            '_id': 'rs0',
+            'members': [
+                {'_id': 0, 'host': f'127.0.0.1:{ports[0]}', 'priority': 1},
+                {'_id': 1, 'host': f'127.0.0.1:{ports[1]}', 'priority': 0},
+            ],
+        })
+        deadline = time.time() + 60
+        while time.time() < deadline:
+            states = {m['name']: m['stateStr'] for m in seed.admin.command('replSetGetStatus')['members']}
+            if sorted(states.values()) == ['PRIMARY', 'SECONDARY']:
+                break
+            time.sleep(0.5)
+        else:
+            pytest.fail("replica set did not become ready")
+        seed.close()
+        yield {
+            'url': f'mongodb://127.0.0.1:{ports[0]},127.0.0.1:{ports[1]}/?replicaSet=rs0',
+            'primary': ('127.0.0.1', ports[0]),
+            'secondary': ('127.0.0.1', ports[1]),
+        }
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait()
+
+
+class CommandRecorder(monitoring.CommandListener):
+    def __init__(self):
+        self.events = []
+
+    def started(self, event):
+        self.events.append((event.command_name, event.connection_id))
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+def test_reads_use_secondary_and_writes_use_primary(replica_set):
+    recorder = CommandRecorder()
+
+    async def scenario():
+        client = create_client(replica_set['url'], env={}, event_listeners=[recorder])
+        db = client['replica_test']
+        read_db = read_database(client, 'replica_test', env={})
+        await db.customers.insert_one({'id': 'c1'})
+        await read_db.customers.find({'id': 'c1'}).to_list(10)
+        client.close()
+
+    asyncio.run(scenario())
+
+    assert ('insert', replica_set['primary']) in recorder.events
+    assert ('find', replica_set['secondary']) in recorder.events
@@ -0,0 +1,57 @@
+import asyncio
+import re
+from datetime import datetime
+
+from invoice import InvoiceRenderer, render_invoice
+
+
+def make_invoice(services=1):
+    now = datetime(2024, 5, 1)
+    return {
+        "workshop_name": "Bengkel (Jaya)",
+        "customer": {"name": "Budi", "phone": "0812"},
+        "session": {"id": "abcdef123456", "session_name": "Servis rutin", "session_date": now},
+        "services": [{"description": f"Ganti oli {index} \\ 😀", "price": 50000} for index in range(services)],
+        "payments": [{"amount": 20000, "description": None, "payment_date": now}],
+    }
+
+
+def test_document_structure_is_valid():
+    document = render_invoice(make_invoice())
+    assert document.startswith(b"%PDF-1.4\n") and document.endswith(b"%%EOF\n")
+
+    # Every xref entry points at the start of its object
+    xref = int(re.search(rb"startxref\n(\d+)", document).group(1))
+    offsets = re.findall(rb"(\d{10}) 00000 n ", document[xref:])
+    for number, offset in enumerate(offsets, start=1):
+        assert document[int(offset):].startswith(b"%d 0 obj" % number)
+
+    # Parentheses and backslashes are escaped, unencodable characters replaced
+    assert rb"Bengkel \(Jaya\)" in document
+    assert rb"Ganti oli 0 \\ ?" in document
+    assert b"Rp 30,000" in document
+
+
+def test_long_invoices_span_pages():
+    document = render_invoice(make_invoice(services=120))
+    assert int(re.search(rb"/Count (\d+)", document).group(1)) > 1
+
+
+def test_renderer_reuses_cached_documents():
+    renderer = InvoiceRenderer(max_workers=1)
+
+    async def scenario():
+        await renderer.start()
+        try:
+            first, second = await asyncio.gather(
+                renderer.render(("W1", "s1", 1), make_invoice()),
+                renderer.render(("W1", "s1", 1), make_invoice()),
+            )
+            third = await renderer.render(("W1", "s1", 1), make_invoice())
+            assert first == second == third
+            await renderer.render(("W1", "s1", 2), make_invoice(services=2))
+        finally:
+            renderer.shutdown()
+
+    asyncio.run(scenario())
+    assert renderer.counters["renders"] == 2 and renderer.counters["hits"] == 1
@@ -0,0 +1,97 @@
+import asyncio
+
+from pymongo.errors import AutoReconnect
+
+from jobs import COMPLETED, JobQueue
+
+
+class UpdateResult:
+    def __init__(self, matched_count):
+        self.matched_count = matched_count
+
+
+class JobCollection:
+    """One job document; updates apply only when their filter matches it"""
+
+    def __init__(self, job):
+        self.job = dict(job)
+        self.updates = []
+
+    async def update_one(self, query, update):
+        self.updates.append(query)
+        if any(self.job.get(key) != value for key, value in query.items()):
+            return UpdateResult(0)
+        self.job.update(update.get("$set", {}))
+        for key in update.get("$unset", {}):
+            self.job.pop(key, None)
+        return UpdateResult(1)
+
+
+def running_job():
+    return {"id": "j1", "type": "slow", "lease_id": "L1", "attempts": 1, "max_attempts": 3, "status": "running"}
+
+
+def test_lease_is_renewed_while_the_job_runs():
+    collection = JobCollection(running_job())
+    queue = JobQueue(collection, lease_seconds=0.03)
+
+    async def slow(job):
+        await asyncio.sleep(0.05)
+        return "done"
+
+    queue.register("slow", slow)
+    asyncio.run(queue.run_job(running_job()))
+
+    renewals = collection.updates[:-1]
+    assert renewals and all(query == {"id": "j1", "lease_id": "L1"} for query in renewals)
+    assert collection.job["status"] == COMPLETED and collection.job["result"] == "done"
+    assert "lease_id" not in collection.job
+
+
+def test_outcome_is_dropped_after_the_lease_passed_to_another_worker():
+    collection = JobCollection(running_job())
+    queue = JobQueue(collection, lease_seconds=600)
+
+    async def overtaken(job):
+        collection.job["lease_id"] = "L2"  # claimed again by another worker meanwhile
+        return "stale"
+
+    queue.register("slow", overtaken)
+    asyncio.run(queue.run_job(running_job()))
+
+    assert collection.job["status"] == "running" and "result" not in collection.job
+
+
+def test_worker_survives_a_failure_to_record_an_outcome():
+    class FlakyCollection(JobCollection):
+        async def update_one(self, query, update):
+            if not self.updates:
+                self.updates.append(query)
+                raise AutoReconnect("primary stepped down")
+            return await super().update_one(query, update)
+
+    collection = FlakyCollection(running_job())
+    ran = []
+
+    class TwoJobs(JobQueue):
+        pending = [running_job(), running_job()]
+
+        async def claim(self):
+            return self.pending.pop() if self.pending else None
+
+    queue = TwoJobs(collection, concurrency=1, poll_interval=0.01)
+
+    async def record(job):
+        ran.append(job["id"])
+        return "done"
+
+    queue.register("slow", record)
+
+    async def scenario():
+        queue.start()
+        await asyncio.sleep(0.05)
+        await queue.stop()
+
+    asyncio.run(scenario())
+    assert ran == ["j1", "j1"]
+    assert collection.job["status"] == COMPLETED
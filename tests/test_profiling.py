@@ -0,0 +1,50 @@
+import time
+
+from starlette.applications import Starlette
+from starlette.responses import PlainTextResponse
+from starlette.routing import Route
+from starlette.testclient import TestClient
+
+from profiling import ProfilingMiddleware
+
+
+def slow_endpoint(request):
+    deadline = time.perf_counter() + 0.05
+    while time.perf_counter() < deadline:
+        pass
+    return PlainTextResponse("ok")
+
+
+def make_client(tmp_path, **kwargs):
+    app = Starlette(routes=[Route("/slow", slow_endpoint)])
+    app.add_middleware(ProfilingMiddleware, output_dir=str(tmp_path), interval=0.001, **kwargs)
+    return TestClient(app)
+
+
+def test_profiles_request_with_admin_header(tmp_path):
+    client = make_client(tmp_path, admin_token="secret")
+    response = client.get("/slow", headers={"X-Profile": "1", "X-Admin-Token": "secret"})
+
+    assert response.status_code == 200
+    profiles = list(tmp_path.glob("*.collapsed"))
+    assert len(profiles) == 1
+    lines = profiles[0].read_text().splitlines()
+    assert lines
+    stack, count = lines[0].rsplit(" ", 1)
+    assert int(count) > 0 and ";" in stack
+
+
+def test_skips_request_without_valid_token(tmp_path):
+    client = make_client(tmp_path, admin_token="secret")
+    client.get("/slow", headers={"X-Profile": "1", "X-Admin-Token": "wrong"})
+    client.get("/slow")
+
+    assert list(tmp_path.glob("*.collapsed")) == []
+
+
+def test_retention_keeps_newest_profiles(tmp_path):
+    client = make_client(tmp_path, sample_rate=1.0, max_files=2)
+    for _ in range(4):
+        client.get("/slow")
+
+    assert len(list(tmp_path.glob("*.collapsed"))) == 2
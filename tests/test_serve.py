@@ -0,0 +1,20 @@
+from serve import configure_workers, worker_count
+
+
+def test_worker_count_prefers_web_concurrency():
+    assert worker_count({"WEB_CONCURRENCY": "3"}) == 3
+    assert worker_count({"WEB_CONCURRENCY": "0"}) == 1
+    assert worker_count({}) >= 1
+
+
+def test_response_cache_is_disabled_for_multiple_workers_unless_configured():
+    env = {}
+    configure_workers(1, env)
+    assert env == {}
+
+    configure_workers(4, env)
+    assert env["RESPONSE_CACHE_ENABLED"] == "false"
+
+    env = {"RESPONSE_CACHE_ENABLED": "true"}
+    configure_workers(4, env)
+    assert env["RESPONSE_CACHE_ENABLED"] == "true"
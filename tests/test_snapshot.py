@@ -0,0 +1,191 @@
+import asyncio
+from datetime import datetime
+
+import pytest
+from pymongo.errors import BulkWriteError
+
+from snapshot import SnapshotError, export_lines, gunzip_lines, gzip_stream, restore_lines
+
+
+class Cursor:
+    def __init__(self, documents):
+        self.documents = documents
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for document in self.documents:
+            yield document
+
+    async def to_list(self, length):
+        return self.documents
+
+
+def matches(document, query):
+    for field, condition in query.items():
+        value = document.get(field)
+        if isinstance(condition, dict):
+            if "$in" in condition and value not in condition["$in"]:
+                return False
+            if "$nin" in condition and value in condition["$nin"]:
+                return False
+        elif value != condition:
+            return False
+    return True
+
+
+class MemoryCollection:
+    """Enough of a Motor collection for snapshots, keyed by ``_id``"""
+
+    def __init__(self, unique=None):
+        self.documents = {}
+        self.unique = unique
+        self.insert_calls = 0
+
+    def find(self, query, projection=None, batch_size=None):
+        return Cursor([d for d in self.documents.values() if matches(d, query)])
+
+    def _collides(self, document):
+        return document["_id"] in self.documents or self.unique is not None and any(
+            existing.get(self.unique) == document.get(self.unique) for existing in self.documents.values()
+        )
+
+    async def insert_many(self, documents, ordered=True):
+        self.insert_calls += 1
+        errors = []
+        for index, document in enumerate(documents):
+            if self._collides(document):
+                errors.append({"index": index, "code": 11000, "errmsg": "duplicate key"})
+            else:
+                self.documents[document["_id"]] = dict(document)
+        if errors:
+            raise BulkWriteError({"writeErrors": errors, "nInserted": len(documents) - len(errors)})
+
+
+class MemoryDatabase(dict):
+    def __missing__(self, name):
+        self[name] = MemoryCollection(unique={"customers": "phone", "users": "username"}.get(name))
+        return self[name]
+
+    def __getattr__(self, name):
+        return self[name]
+
+
+async def collect(iterator):
+    return [item async for item in iterator]
+
+
+async def chunked(data, size=7):
+    for start in range(0, len(data), size):
+        yield data[start:start + size]
+
+
+def source_database():
+    db = MemoryDatabase()
+    now = datetime(2024, 5, 1, 8, 30)
+    for index in range(5):
+        document = {"_id": f"s{index}", "id": f"s{index}", "workshop_id": "w1", "price": 1000.5, "created_at": now}
+        db["services"].documents[document["_id"]] = document
+    db["services"].documents["other"] = {"_id": "other", "workshop_id": "w2"}
+    db["customers"].documents["c1"] = {"_id": "c1", "workshop_id": "w1", "name": "Budi", "phone": "62812"}
+    return db
+
+
+async def snapshot_of(db, workshop_id="w1", chunk_size=2):
+    compressed = b"".join(await collect(gzip_stream(export_lines(db, workshop_id, chunk_size))))
+    return await collect(gunzip_lines(chunked(compressed)))
+
+
+def test_round_trip_restores_the_workshop_and_skips_existing_documents():
+    async def scenario():
+        lines = await snapshot_of(source_database())
+        target = MemoryDatabase()
+
+        async def replay():
+            for line in lines:
+                yield line
+
+        first = await restore_lines(target, replay(), concurrency=2)
+        second = await restore_lines(target, replay(), concurrency=2)
+        return lines, target, first, second
+
+    lines, target, first, second = asyncio.run(scenario())
+    # Header, one customer chunk, three service chunks of at most two, end
+    assert len(lines) == 6
+    assert first["complete"] and first["counts"] == {"services": 5, "customers": 1}
+    assert target["services"].insert_calls == 6
+    restored = target["services"].documents
+    assert sorted(restored) == ["s0", "s1", "s2", "s3", "s4"]
+    assert restored["s0"]["created_at"] == datetime(2024, 5, 1, 8, 30)
+    assert restored["s0"]["price"] == 1000.5
+    assert second["complete"] and second["skipped_existing"] == {"services": 5, "customers": 1}
+
+
+def test_truncated_snapshot_is_reported_incomplete():
+    async def scenario():
+        lines = await snapshot_of(source_database())
+
+        async def replay():
+            for line in lines[:-2]:
+                yield line
+
+        return await restore_lines(MemoryDatabase(), replay())
+
+    report = asyncio.run(scenario())
+    assert not report["complete"]
+    assert report["counts"] == {"customers": 1, "services": 4}
+
+
+@pytest.mark.parametrize("lines, message", [
+    ([b'{"format": "something-else", "version": 1}'], "Not a workshop snapshot"),
+    ([b'{"format": "workshop-snapshot", "version": 1, "workshop_id": "w2"}'], "belongs to workshop w2"),
+    ([b'{"format": "workshop-snapshot", "version": 1, "workshop_id": "w1"}',
+      b'{"collection": "refresh_tokens", "documents": []}'], "Unexpected collection"),
+    ([b'{"format": "workshop-snapshot", "version": 1, "workshop_id": "w1"}',
+      b'{"collection": "customers", "documents": [{"_id": "x", "workshop_id": "w2"}]}'], "another workshop"),
+])
+def test_invalid_snapshots_are_rejected(lines, message):
+    async def scenario():
+        async def replay():
+            for line in lines:
+                yield line
+
+        await restore_lines(MemoryDatabase(), replay(), workshop_id="w1")
+
+    with pytest.raises(SnapshotError, match=message):
+        asyncio.run(scenario())
+
+
+def replay_of(lines):
+    async def replay():
+        for line in lines:
+            yield line
+    return replay()
+
+
+def test_unique_index_conflicts_are_reported_not_skipped():
+    async def scenario():
+        lines = await snapshot_of(source_database())
+        target = MemoryDatabase()
+        # A different customer of the target already has the phone number
+        target["customers"].documents["c9"] = {"_id": "c9", "workshop_id": "w1", "phone": "62812"}
+        return await restore_lines(target, replay_of(lines))
+
+    report = asyncio.run(scenario())
+    assert report["skipped_existing"] == {"services": 0, "customers": 0}
+    assert report["conflicts"] == {"customers": 1}
+    assert not report["complete"]
+
+
+def test_taken_usernames_stop_the_restore():
+    async def scenario():
+        source = source_database()
+        source["users"].documents["u1"] = {"_id": "u1", "id": "u1", "workshop_id": "w1", "username": "budi"}
+        lines = await snapshot_of(source)
+        target = MemoryDatabase()
+        target["users"].documents["u7"] = {"_id": "u7", "id": "u7", "workshop_id": "w7", "username": "budi"}
+        await restore_lines(target, replay_of(lines))
+
+    with pytest.raises(SnapshotError, match="Usernames already taken: budi"):
+        asyncio.run(scenario())
@@ -0,0 +1,30 @@
+from suggest import SuggestionIndex, normalize_description, typical_price
+
+
+def test_prefix_search_ranks_by_usage_and_tracks_removals():
+    index = SuggestionIndex()
+    for description, price in [
+        ("Ganti Oli", 50000), ("ganti  oli", 55000), ("ganti oli", 55000),
+        ("Ganti Kampas Rem", 120000), ("Servis CVT", 75000),
+    ]:
+        index.apply(normalize_description(description), description, price, 1)
+
+    results = index.search(normalize_description("GANTI"), 10)
+    assert [entry["key"] for entry in results] == ["ganti oli", "ganti kampas rem"]
+    assert results[0]["count"] == 3 and typical_price(results[0]) == 55000
+    assert index.search("servis cvt x", 10) == []
+    assert len(index.search("", 1)) == 1
+
+    index.apply("ganti kampas rem", "Ganti Kampas Rem", 120000, -1)
+    assert [entry["key"] for entry in index.search("ganti", 10)] == ["ganti oli"]
+    assert len(index) == 2
+
+
+def test_typical_price_prefers_latest_on_ties():
+    index = SuggestionIndex()
+    index.apply("spooring", "Spooring", 100000, 1)
+    index.apply("spooring", "Spooring", 90000, 1)
+    assert typical_price(index.search("spo", 1)[0]) == 90000
+
+    index.apply("spooring", "Spooring", 90000, -1)
+    assert typical_price(index.search("spo", 1)[0]) == 100000